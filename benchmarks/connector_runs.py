@@ -0,0 +1,173 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+"""Measure Fulfillment, usage and usage files runs end-to-end without network access
+
+CloudBlue Connect is replaced with local HTTP server (fake_connect.py) and
+backend with package from fake_backend directory. Each run is made in a
+separate process, so its peak RSS is measured.
+
+Usage: python3 benchmarks/connector_runs.py [--assets 100,1000,10000] [--runners usage,fulfillment,usage_files]
+           [--backend-latency SECONDS] [--connect-latency SECONDS] [--misc OPTION=JSON_VALUE ...] [--json]
+
+Example: python3 benchmarks/connector_runs.py --assets 1000 --runners usage --misc usage_workers=8
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_BACKEND_DIR = os.path.join(BENCHMARKS_DIR, 'fake_backend')
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+RUNNERS = {
+    # runner -> (function of cloudblue_connector.runners, objects served by fake Connect for N Assets)
+    'usage': ('process_usage', lambda n: {'assets': n}),
+    'fulfillment': ('process_fulfillment', lambda n: {'assets': n, 'requests': n}),
+    'usage_files': ('process_usage_files', lambda n: {'assets': n, 'usage_files': n}),
+}
+
+
+def is_failed(outcome):
+    """Check outcome of request in run summary: failure of SDK, error or name of raised exception"""
+    return outcome in ('failure', 'error', 'fail', '') or outcome[:1].isupper()
+
+
+def run_child(runner, config_file):
+    """Make one run in this process and print its measurements in JSON"""
+    import cloudblue_connector.runners as runners
+    from cloudblue_connector.core import metrics
+
+    runners.CONFIG_FILE = config_file
+    started = time.time()
+    summary = getattr(runners, RUNNERS[runner][0])()
+    wall = time.time() - started
+
+    stages = {}
+    for histogram, stage, label in ((metrics.CONNECT_DURATION, 'connect', 0),
+                                    (metrics.CONSUMPTION_DURATION, 'consumption', None),
+                                    (metrics.BACKEND_CHECK_DURATION, 'backend_check', None)):
+        for key, (_, total, count) in list(histogram.values.items()):
+            name = stage if label is None else '{}:{}'.format(stage, key[label])
+            total_so_far, count_so_far = stages.get(name, (0.0, 0))
+            stages[name] = (total_so_far + total, count_so_far + count)
+
+    counters = summary.as_dict()['counters'] if summary is not None else []
+    print(json.dumps({
+        'wall': wall,
+        'processed': summary.processed if summary is not None else 0,
+        'outcomes': {'{}/{}'.format(c['status'], c['outcome']): c['count'] for c in counters},
+        'failed': sum(c['count'] for c in counters if is_failed(c['outcome'])),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stages': {name: {'seconds': total, 'count': count} for name, (total, count) in stages.items()},
+    }))
+
+
+def make_config(api_url, misc):
+    from fake_connect import PRODUCT_ID
+
+    config = {
+        'apiEndpoint': api_url,
+        'apiKey': 'ApiKey SU-000-000-000:benchmark',
+        'products': [PRODUCT_ID],
+        'report_usage': [PRODUCT_ID],
+        'templates': {},
+        # local state of usage reports and circuit breaker is not stored, so runs do not touch state of services
+        'misc': dict({'hidePasswordsInLog': True, 'usage_state_db': '', 'backend_breaker_state_db': ''}, **misc),
+    }
+    fd, path = tempfile.mkstemp(prefix='connector-bench-', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(config, f)
+    return path
+
+
+def run_scenario(state, api_url, runner, assets, args, misc):
+    state.reset(**RUNNERS[runner][1](assets))
+    config_file = make_config(api_url, misc)
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([FAKE_BACKEND_DIR, REPO_DIR, os.environ.get('PYTHONPATH', '')]),
+               BENCH_BACKEND_LATENCY=str(args.backend_latency))
+    try:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', runner, config_file],
+                               env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.PIPE,
+                               universal_newlines=True)
+    finally:
+        os.remove(config_file)
+    if child.returncode != 0:
+        raise RuntimeError('{} run with {} Assets failed:\n{}'.format(runner, assets, child.stderr or ''))
+
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    # a run where requests fail measures error handling only, it is not a result
+    if result['failed'] or not result['processed']:
+        raise RuntimeError('{} run with {} Assets has {} failed of {} processed requests: {}'.format(
+            runner, assets, result['failed'], result['processed'], result['outcomes']))
+    result.update(runner=runner, assets=assets, api_calls=sum(state.calls.values()), calls=dict(state.calls))
+    return result
+
+
+def format_result(result):
+    lines = ['{runner:<12} {assets:>6} Assets: {wall:8.2f} s, {processed} processed, {api_calls} API calls, '
+             'peak RSS {rss:.1f} MB'.format(rss=result['peak_rss_kb'] / 1024.0, **result),
+             '    outcomes: {}'.format(', '.join('{} {}'.format(outcome, count)
+                                                 for outcome, count in sorted(result['outcomes'].items())))]
+    for name, stage in sorted(result['stages'].items()):
+        lines.append('    {:<40} {:8.2f} s in {} calls'.format(name, stage['seconds'], stage['count']))
+    return '\n'.join(lines)
+
+
+def parse_misc(values):
+    misc = {}
+    for value in values or []:
+        option, _, raw = value.partition('=')
+        misc[option] = json.loads(raw)
+    return misc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--assets', default='100,1000,10000', help='comma separated numbers of Assets')
+    parser.add_argument('--runners', default=','.join(sorted(RUNNERS)), help='comma separated runners')
+    parser.add_argument('--backend-latency', type=float, default=0.0, help='latency of each backend call')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='latency of each Connect API call')
+    parser.add_argument('--misc', action='append', help='misc option of connector config, e.g. usage_workers=8')
+    parser.add_argument('--json', action='store_true', help='print results in JSON')
+    parser.add_argument('--verbose', action='store_true', help='show log of runs')
+    parser.add_argument('--child', nargs=2, metavar=('RUNNER', 'CONFIG'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    sys.path.insert(0, FAKE_BACKEND_DIR)
+    from fake_connect import ConnectState, start_server
+
+    state = ConnectState(args.connect_latency)
+    server, api_url = start_server(state)
+    misc = parse_misc(args.misc)
+    results = []
+    try:
+        for runner in args.runners.split(','):
+            for assets in (int(n) for n in args.assets.split(',')):
+                result = run_scenario(state, api_url, runner, assets, args, misc)
+                results.append(result)
+                if not args.json:
+                    print(format_result(result))
+                    sys.stdout.flush()
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+from connect.config import Config
+from connect.models import ActivationTemplateResponse, Contract, Product, UsageFile
+
+from cloudblue_connector_backend.consumption.base import Consumption, backend_latency
+
+MPNS = ('CPU_consumption', 'RAM_consumption', 'Storage_consumption', 'Outgoing_Traffic_consumption')
+
+
+class ConnectorConfig(Config):
+    """Connect configuration with misc options of connector"""
+
+    def __init__(self, file, report_usage=False):
+        super(ConnectorConfig, self).__init__(file=file)
+        with open(file) as config_file:
+            self.misc = json.load(config_file).get('misc', {})
+        self.report_usage = report_usage
+
+
+def wait_backend():
+    latency = backend_latency()
+    if latency:
+        time.sleep(latency)
+
+
+class ConnectorMixin(object):
+    """Backend calls answered locally after configured latency (BENCH_BACKEND_LATENCY seconds)"""
+
+    consumptions = {mpn: Consumption() for mpn in MPNS}
+    usage_record_search_criteria = 'id'
+
+    def is_backend_alive(self):
+        wait_backend()
+        return True
+
+    def is_resource_exist(self, subscription_id):
+        wait_backend()
+        return True
+
+    def is_report_suspended_needed(self):
+        return False
+
+    def test_marketplace_requests_filter(self, conf, request_id, marketplace):
+        return False
+
+    def create_usage_file(self, name, description, request, start_time, end_time):
+        return UsageFile(
+            name=name,
+            description=description,
+            product=Product(id=request.product.id),
+            contract=Contract(id=request.contract.id),
+        )
+
+    def process_fulfillment_request(self, request):
+        wait_backend()
+        return ActivationTemplateResponse('TL-000-000-000'), {}
@@ -0,0 +1,5 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
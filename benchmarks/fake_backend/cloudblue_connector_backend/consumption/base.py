@@ -0,0 +1,33 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+
+def backend_latency():
+    return float(os.environ.get('BENCH_BACKEND_LATENCY', '0'))
+
+
+class Consumption(object):
+    """Collector which returns constant consumption after configured latency"""
+
+    def __init__(self, value=1):
+        self.value = value
+
+    def collect_consumption(self, project_id, start_time, end_time):
+        latency = backend_latency()
+        if latency:
+            time.sleep(latency)
+        return self.value
+
+
+class Zero(Consumption):
+    def __init__(self):
+        super(Zero, self).__init__(0)
+
+    def collect_consumption(self, project_id, start_time, end_time):
+        return 0
@@ -0,0 +1,224 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+"""Local stand-in for CloudBlue Connect API used by offline benchmarks
+
+Serves Assets, Fulfillment requests, their conversations and usage files
+kept in memory and counts API calls per method and path.
+"""
+
+import collections
+import json
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+
+from cloudblue_connector_backend.connector import MPNS
+
+API_PATH = '/public/v1/'
+PRODUCT_ID = 'PRD-000-000-001'
+TEST_MARKETPLACE_ID = 'MP-00001'
+MARKETPLACE_ID = 'MP-00002'
+
+
+def make_asset(index):
+    asset_id = 'AS-{:04d}-{:04d}'.format(index // 10000, index % 10000)
+    return {
+        'id': asset_id,
+        'status': 'active',
+        'external_id': str(index),
+        'external_uid': asset_id,
+        'product': {'id': PRODUCT_ID, 'name': 'Benchmark product'},
+        'connection': {
+            'id': 'CT-0001',
+            'type': 'production',
+            'provider': {'id': 'PA-0001', 'name': 'Provider'},
+            'vendor': {'id': 'VA-0001', 'name': 'Vendor'},
+        },
+        'contract': {'id': 'CRD-0001', 'name': 'Contract'},
+        'marketplace': {'id': MARKETPLACE_ID, 'name': 'Marketplace'},
+        'params': [
+            {'id': 'project_id', 'type': 'text', 'value': 'project-{}'.format(index)},
+            {'id': 'resume_date', 'type': 'text', 'value': ''},
+        ],
+        'items': [
+            {'id': 'PRD-000-000-001-{:04d}'.format(i), 'mpn': mpn, 'quantity': '0'}
+            for i, mpn in enumerate(MPNS)
+        ],
+    }
+
+
+class ConnectState(object):
+    """Objects served by fake Connect and counters of API calls"""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, assets=0, requests=0, usage_files=0):
+        with self.lock:
+            self.calls = collections.Counter()
+            self.assets = [make_asset(i) for i in range(assets)]
+            self.requests = collections.OrderedDict()
+            for asset in self.assets[:requests]:
+                request_id = 'PR-{}-001'.format(asset['id'][3:])
+                self.requests[request_id] = {
+                    'id': request_id,
+                    'type': 'purchase',
+                    'status': 'pending',
+                    'created': '2020-01-01T00:00:00+00:00',
+                    'updated': '2020-01-01T00:00:00+00:00',
+                    'marketplace': asset['marketplace'],
+                    'contract': asset['contract'],
+                    'asset': asset,
+                }
+            self.usage_files = collections.OrderedDict()
+            now = datetime.utcnow()
+            for i, asset in enumerate(self.assets[:usage_files]):
+                self.add_usage_file(
+                    '{}_{}'.format(asset['id'], now.strftime('%Y-%m-%d_%Hh')),
+                    'Report for {} {}'.format(asset['id'], now.strftime('%Y-%m-%d %H:00:00')),
+                    ('ready', 'pending', 'invalid')[i % 3])
+
+    def add_usage_file(self, name, description, status):
+        usage_file_id = 'UF-{:04d}-{:04d}'.format(len(self.usage_files) // 10000, len(self.usage_files) % 10000)
+        at = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        usage_file = {
+            'id': usage_file_id,
+            'name': name,
+            'description': description,
+            'status': status,
+            'product': {'id': PRODUCT_ID},
+            'contract': {'id': 'CRD-0001'},
+            'events': {'created': {'at': at}, 'uploaded': {'at': at}},
+        }
+        self.usage_files[usage_file_id] = usage_file
+        return usage_file
+
+    @staticmethod
+    def page(items, query):
+        limit = re.search(r'limit=(\d+)', query)
+        offset = re.search(r'offset=(\d+)', query)
+        offset = int(offset.group(1)) if offset else 0
+        limit = int(limit.group(1)) if limit else 100
+        return items[offset:offset + limit]
+
+    @staticmethod
+    def statuses(query):
+        match = re.search(r'in\(status,\(([^)]*)\)\)', query) or re.search(r'status=([\w,]+)', query)
+        return set(match.group(1).split(',')) if match else None
+
+    def handle(self, method, path, query, body):
+        """Return (HTTP status, response object) for API call"""
+
+        with self.lock:
+            parts = path.strip('/').split('/')
+            template = '/'.join(p if not re.match(r'^[A-Z]{2}-', p) else '{id}' for p in parts)
+            self.calls['{} {}'.format(method, template)] += 1
+            statuses = self.statuses(query)
+
+            if method == 'GET' and parts == ['assets']:
+                return 200, self.page([a for a in self.assets if not statuses or a['status'] in statuses], query)
+
+            if method == 'GET' and parts == ['requests']:
+                requests = [r for r in self.requests.values() if r['status'] == 'pending']
+                return 200, self.page(requests, query)
+            if parts[0] == 'requests' and len(parts) >= 2 and parts[1] in self.requests:
+                request = self.requests[parts[1]]
+                if method == 'POST' and len(parts) == 3:
+                    request['status'] = {'approve': 'approved', 'fail': 'failed', 'inquire': 'inquiring'}.get(
+                        parts[2], request['status'])
+                return 200, request
+
+            # Fulfillment dispatch of Connect SDK looks up conversation of each request and posts messages to it
+            if parts[0] == 'conversations':
+                if method == 'GET' and len(parts) == 1:
+                    return 200, []
+                if method == 'POST' and len(parts) == 1:
+                    payload = json.loads(body or '{}')
+                    return 201, {'id': 'CO-{}'.format(payload.get('instance_id', 'PR-0000')[3:]),
+                                 'instance_id': payload.get('instance_id'), 'messages': []}
+                if method == 'POST' and len(parts) == 3 and parts[2] == 'messages':
+                    payload = json.loads(body or '{}')
+                    return 201, {'id': 'ME-0001', 'conversation': parts[1], 'text': payload.get('text')}
+                return 200, {'id': parts[1], 'messages': []}
+
+            if parts[:2] == ['usage', 'files']:
+                if method == 'GET' and len(parts) == 2:
+                    return 200, self.page(
+                        [f for f in self.usage_files.values() if not statuses or f['status'] in statuses], query)
+                if method == 'POST' and len(parts) == 2:
+                    payload = json.loads(body or '{}')
+                    return 201, self.add_usage_file(payload.get('name'), payload.get('description'), 'draft')
+                usage_file = self.usage_files.get(parts[2])
+                if usage_file is None:
+                    return 404, {'error_code': 'UF_404', 'errors': ['not found']}
+                if method == 'POST' and len(parts) == 4:
+                    usage_file['status'] = {'upload': 'ready', 'submit': 'pending', 'accept': 'accepted',
+                                            'delete': 'deleted', 'reject': 'rejected'}.get(parts[3],
+                                                                                         usage_file['status'])
+                    # upload of usage file spreadsheet is answered with 201 Created, as SDK expects
+                    if parts[3] == 'upload':
+                        return 201, usage_file
+                return 200, usage_file
+
+            return 404, {'error_code': 'API_404', 'errors': ['{} {} is not implemented'.format(method, path)]}
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ConnectHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def handle_call(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path, _, query = self.path.partition('?')
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if not path.startswith(API_PATH):
+            status, response = 404, {'errors': ['unknown API']}
+        else:
+            content_type = self.headers.get('Content-Type') or ''
+            text = body.decode('utf-8', 'replace') if 'json' in content_type else None
+            status, response = self.state.handle(method, path[len(API_PATH):], unquote(query), text)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_call('GET')
+
+    def do_POST(self):
+        self.handle_call('POST')
+
+    def do_PUT(self):
+        self.handle_call('PUT')
+
+    def do_DELETE(self):
+        self.handle_call('DELETE')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(state, port=0):
+    """Start fake Connect in background thread, return server and API url"""
+    handler = type('Handler', (ConnectHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='fake-connect')
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}{}'.format(server.server_address[1], API_PATH)
@@ -0,0 +1,83 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+"""Check import time of connector entry points against budget
+
+Each entry point is imported in a new interpreter with `python -X importtime`,
+the best of several attempts is compared with its budget. Heavy packages
+which must be imported only when they are used are checked as well.
+Exit status is 1 if any check fails, so the script can be used in CI.
+
+Usage: python3 benchmarks/import_time.py [--attempts N] [--scale FACTOR]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point -> (budget in milliseconds, packages which must not be imported)
+ENTRY_POINTS = {
+    'cloudblue_connector.runners': (
+        100, ('connect', 'cryptography', 'requests', 'cloudblue_connector.automation', 'cloudblue_connector_backend',
+              'logging.config', 'http.server')),
+    'cloudblue_connector.core.pass_encryptor': (
+        100, ('connect', 'cryptography', 'requests')),
+}
+
+
+def measure(module):
+    """Return cumulative import time of module (in milliseconds) and names of all imported modules"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get('PYTHONPATH', '')]))
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                           env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if child.returncode != 0:
+        raise RuntimeError('{} cannot be imported:\n{}'.format(module, child.stderr))
+
+    cumulative = None
+    imported = set()
+    for line in child.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+        if not fields[1].isdigit():
+            continue
+        name = fields[2]
+        imported.add(name)
+        if name == module:
+            cumulative = int(fields[1]) / 1000.0
+    return cumulative, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--attempts', type=int, default=5, help='number of imports, the fastest one is checked')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of budgets for slow machines')
+    args = parser.parse_args()
+
+    failed = False
+    for module, (budget, forbidden) in sorted(ENTRY_POINTS.items()):
+        best = None
+        imported = set()
+        for _ in range(args.attempts):
+            cumulative, imported = measure(module)
+            best = cumulative if best is None else min(best, cumulative)
+        budget *= args.scale
+
+        heavy = sorted(name for name in imported if name.split('.')[0] in forbidden or name in forbidden)
+        status = 'ok' if best <= budget and not heavy else 'FAILED'
+        failed = failed or status != 'ok'
+        print('{:<45} {:8.1f} ms (budget {:.0f} ms) {}'.format(module, best, budget, status))
+        if heavy:
+            print('    imports {}'.format(', '.join(heavy)))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+"""Measure cost of PasswordFilter per log record
+
+Usage: python3 benchmarks/password_filter.py [number of records]
+"""
+
+import json
+import logging
+import sys
+import timeit
+
+from cloudblue_connector.core.logger import PasswordFilter
+
+
+def make_payload(requests_count):
+    return json.dumps([
+        {
+            'id': 'PR-{}'.format(i),
+            'params': [
+                {'id': 'login', 'type': 'text', 'value': 'user{}'.format(i)},
+                {'id': 'password', 'type': 'password', 'value': 'secret{}'.format(i)},
+            ],
+            'asset': {'id': 'AS-{}'.format(i), 'params': []},
+        }
+        for i in range(requests_count)
+    ])
+
+
+def make_records():
+    return {
+        'ordinary message': ('Processing Usage for Product %s on Contract %s', ('PRD-1', 'CRD-1')),
+        'API payload without passwords': ('Function `FulfillmentAutomation.search` return: {}'.format(
+            json.dumps([{'id': 'PR-{}'.format(i), 'params': []} for i in range(100)])), None),
+        'API payload with 1 password': (
+            'Function `FulfillmentAutomation.search` return: {}'.format(make_payload(1)), None),
+        'API payload with 100 passwords': (
+            'Function `FulfillmentAutomation.search` return: {}'.format(make_payload(100)), None),
+    }
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    PasswordFilter.is_enabled = True
+    password_filter = PasswordFilter()
+
+    for name, (msg, args) in make_records().items():
+        def run():
+            password_filter.filter(logging.LogRecord('connect', logging.DEBUG, __file__, 0, msg, args, None))
+
+        seconds = timeit.timeit(run, number=number)
+        print('{:<35} {:>12.2f} us/record'.format(name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
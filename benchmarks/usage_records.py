@@ -0,0 +1,103 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+"""Compare records per second and peak memory of usage file generation
+
+The current path creates UsageRecord of Connect SDK for each MPN and builds
+spreadsheet in memory with UsageAutomation._create_spreadsheet of SDK before
+it is saved. The streaming path creates compact records sharing one window
+and writes rows to spooled temporary file.
+
+Usage: python3 benchmarks/usage_records.py [number of records] [number of MPNs per Asset]
+"""
+
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+
+from connect.models import UsageRecord as SdkUsageRecord
+from connect.resources import UsageAutomation
+
+from cloudblue_connector.automation.usage_records import UsageRecord, UsageWindow, write_usage_spreadsheet
+
+END_TIME = datetime(2023, 1, 1, 12)
+START_TIME = END_TIME - timedelta(hours=1)
+
+
+def mpns_of(records_count, mpns_count):
+    for i in range(records_count):
+        yield 'AS-{}'.format(i // mpns_count), 'MPN-{}'.format(i % mpns_count), i
+
+
+def sdk_records(records_count, mpns_count):
+    return [
+        SdkUsageRecord(
+            usage_record_id='{}-{}-{}'.format(asset_id, END_TIME.isoformat(), mpn),
+            item_search_criteria='item.mpn',
+            item_search_value=mpn,
+            amount=value,
+            quantity=value,
+            start_time_utc=START_TIME.strftime('%Y-%m-%d %H:%M:%S'),
+            end_time_utc=END_TIME.strftime('%Y-%m-%d %H:%M:%S'),
+            asset_search_criteria='id',
+            asset_search_value=asset_id,
+        )
+        for asset_id, mpn, value in mpns_of(records_count, mpns_count)
+    ]
+
+
+def compact_records(records_count, mpns_count):
+    records = []
+    window = None
+    for asset_id, mpn, value in mpns_of(records_count, mpns_count):
+        if window is None or window.subscription_id != asset_id:
+            window = UsageWindow(asset_id, START_TIME, END_TIME, 'id', '{}-{}-'.format(asset_id, END_TIME.isoformat()))
+        records.append(UsageRecord(window, mpn, value))
+    return records
+
+
+def current_path(records_count, mpns_count):
+    records = sdk_records(records_count, mpns_count)
+    # spreadsheet does not depend on engine configuration, so engine is not initialized
+    book = UsageAutomation.__new__(UsageAutomation)._create_spreadsheet(records)
+    with NamedTemporaryFile() as tmp:
+        book.save(tmp)
+        tmp.seek(0)
+        return len(tmp.read())
+
+
+def streaming_path(records_count, mpns_count):
+    records = compact_records(records_count, mpns_count)
+    with SpooledTemporaryFile(max_size=10 * 1024 * 1024) as spool:
+        write_usage_spreadsheet(spool, records)
+        spool.seek(0)
+        return len(spool.read())
+
+
+def measure(path, records_count, mpns_count):
+    tracemalloc.start()
+    started = time.time()
+    size = path(records_count, mpns_count)
+    elapsed = time.time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return records_count / elapsed, peak, size
+
+
+def main():
+    records_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    mpns_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print('{} records, {} MPNs per Asset'.format(records_count, mpns_count))
+    for name, path in (('current', current_path), ('streaming', streaming_path)):
+        rate, peak, size = measure(path, records_count, mpns_count)
+        print('{:<10} {:10.0f} records/s  peak {:8.1f} MiB  file {:8.1f} KiB'.format(
+            name, rate, peak / 1024.0 / 1024.0, size / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
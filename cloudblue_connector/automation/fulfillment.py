@@ -4,26 +4,88 @@
 # ******************************************************************************
 # -*- coding: utf-8 -*-
 
+import threading
+
 from connect import resources
-from connect.config import Config
 from connect.exceptions import SkipRequest
 from cloudblue_connector_backend.connector import ConnectorMixin
-from cloudblue_connector.core.logger import context_log
+from cloudblue_connector.core import breaker, metrics
+from cloudblue_connector.core.concurrency import run_ordered, run_ordered_in_pool
+from cloudblue_connector.core.logger import ContextLoggerMixin, context_log
+from cloudblue_connector.core.summary import RunSummary
 
 
-class FulfillmentAutomation(resources.FulfillmentAutomation, ConnectorMixin):
+class FulfillmentAutomation(ContextLoggerMixin, resources.FulfillmentAutomation, ConnectorMixin):
     """This is the automation engine for Fulfillments processing"""
 
-    fulfillments = []
+    # outcomes of process_request after which following requests of the Asset can be processed
+    completed_outcomes = ('approve', 'fail')
+
+    def __init__(self, *args, **kwargs):
+        super(FulfillmentAutomation, self).__init__(*args, **kwargs)
+        self.summary = RunSummary(self.__class__.__name__)
+        # set by daemon to stop taking new requests on shutdown
+        self.stop_event = None
+        # outcome of the request processed by the current thread
+        self.processed = threading.local()
+
+    def process(self, filters=None):
+        """Process all pending requests, concurrently if fulfillment_workers is configured
+
+        Requests of different Assets are processed concurrently, requests of
+        the same Asset are processed one by one in order they are listed. If
+        a request is not completed, following requests of its Asset are
+        skipped until the next run.
+        """
+
+        misc = self.config.misc
+        workers = misc.get('fulfillment_workers', 1)
+        if workers <= 1:
+            failed = run_ordered(self.dispatch_in_order, self.list(filters), self.asset_of, self.stop_event)
+        else:
+            self.logger.info("Processing requests with %s workers", workers)
+            failed = run_ordered_in_pool(self.dispatch_in_order, self.list(filters), self.asset_of, workers,
+                                         timeout=misc.get('fulfillment_request_timeout'), name='fulfillment',
+                                         stop_event=self.stop_event)
+        if failed:
+            self.logger.error("%s requests are not processed, following requests of their Assets are skipped",
+                              failed)
+
+    @staticmethod
+    def asset_of(request):
+        return request.asset.id
+
+    def dispatch_in_order(self, request):
+        """Dispatch request, return True if following requests of its Asset can be processed
+
+        Dispatch of Connect SDK handles all exceptions of process_request, so
+        the outcome is taken from process_request. The request is completed
+        if it is approved or failed and the transition is made in Connect.
+        """
+        self.processed.outcome = [None]
+        rv = self.dispatch(request)
+        return bool(rv) and self.processed.outcome[0] in self.completed_outcomes
+
+    def list(self, filters=None):
+        with metrics.CONNECT_DURATION.time(operation='list_requests'):
+            return super(FulfillmentAutomation, self).list(filters)
+
+    @context_log
+    def dispatch(self, request):
+        return super(FulfillmentAutomation, self).dispatch(request)
 
     @context_log
     def process_request(self, request):
         """Each new Fulfillment is processed by this function"""
 
-        conf = Config.get_instance()
+        with self.summary.track(request) as outcome:
+            self.processed.outcome = outcome
+            rv = self._process_request(request)
+            outcome[0] = 'approve' if rv else 'none'
+        return rv
 
-        # store all processed request for debug
-        self.fulfillments.append(request)
+    def _process_request(self, request):
+        conf = self.config
 
         if request.needs_migration():
             # Skip request if it needs migration
@@ -31,10 +93,17 @@ class FulfillmentAutomation(resources.FulfillmentAutomation, ConnectorMixin):
             self.logger.info('Skipping request %s because it needs migration.', request.id)
             raise SkipRequest()
 
+        # requests of other Marketplaces are excluded by listing query of runners, the check is kept for other callers
         if self.test_marketplace_requests_filter(conf, request.id, request.asset.marketplace):
             raise SkipRequest()
 
-        rv, params_update = self.process_fulfillment_request(request)
+        try:
+            rv, params_update = breaker.backend.call(self.process_fulfillment_request, request)
+        except breaker.BackendUnavailable:
+            # request stays pending and is processed by the next run
+            self.logger.warning('Skipping request %s because backend is unavailable.', request.id)
+            raise SkipRequest()
         if params_update:
-            self.update_parameters(request.id, params_update)
+            with metrics.CONNECT_DURATION.time(operation='update_parameters'):
+                self.update_parameters(request.id, params_update)
         return rv
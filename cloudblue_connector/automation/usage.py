@@ -4,40 +4,150 @@
 # ******************************************************************************
 # -*- coding: utf-8 -*-
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from copy import copy
 from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
 
+import requests
 from connect import resources
-from connect.config import Config
-from connect.models import UsageRecord
+from connect.exceptions import FileCreationError
 
 from cloudblue_connector_backend.connector import ConnectorMixin
 from cloudblue_connector_backend.consumption.base import Zero
 
 from cloudblue_connector.automation.usage_file import UsageFileAutomation
+from cloudblue_connector.automation.usage_records import (
+    MultipartFile, UsageRecord, UsageWindow, write_usage_spreadsheet)
+from cloudblue_connector.core import breaker, metrics, profiling
+from cloudblue_connector.core.concurrency import limiter, run_in_pool, run_sequentially
+from cloudblue_connector.core.logger import ContextLoggerMixin, config_context, context_data, context_log
+from cloudblue_connector.core.sharding import create_shard
+from cloudblue_connector.core.summary import RunSummary
+from cloudblue_connector.core.usage_state import UsageReportState
 from connect.rql import Query
 
 
-
-class UsageAutomation(resources.UsageAutomation, ConnectorMixin):
+class UsageAutomation(ContextLoggerMixin, resources.UsageAutomation, ConnectorMixin):
     """Automates reporting of Usage Files"""
 
-    usages = []
+    # latest usage report per Asset, filled by prefetch_usage_reports()
+    usage_reports = None
+    usage_reports_month = None
+    # number of Assets looked up one by one in the run before usage reports are prefetched
+    usage_report_lookups = 0
+
+    def __init__(self, *args, **kwargs):
+        super(UsageAutomation, self).__init__(*args, **kwargs)
+        misc = self.config.misc
+        # limits of concurrent calls to backend and Connect in concurrent mode
+        self.backend_calls = limiter(misc.get('usage_backend_concurrency'))
+        self.connect_calls = limiter(misc.get('usage_connect_concurrency'))
+        self._consumption_pool = None
+        self._consumption_pool_lock = threading.Lock()
+        self._usage_reports_lock = threading.Lock()
+        # last reported period of each subscription, used to skip remote lookups
+        state_db = misc.get('usage_state_db', UsageReportState.state_db)
+        self.usage_state = self.open_usage_state(state_db) if state_db else None
+        # partition of Assets processed by this node, None if sharding is not enabled
+        self.shard = create_shard(misc)
+        # one engine is used to list usage files of all Assets
+        self.usage_files = UsageFileAutomation(self.config)
+        self.summary = RunSummary(self.__class__.__name__)
+        # set by daemon to stop taking new Assets on shutdown
+        self.stop_event = None
+
+    def process(self, filters=None):
+        """Process all Assets, concurrently if usage_workers is configured"""
+
+        workers = self.config.misc.get('usage_workers', 1)
+        if self.shard is not None:
+            self.shard.refresh()
+        self.reset_usage_reports()
+        try:
+            if workers <= 1:
+                run_sequentially(self.dispatch, self.list(filters), self.stop_event)
+                return
+
+            self.logger.info("Processing Assets with %s workers", workers)
+            failed = run_in_pool(self.dispatch, self.list(filters), workers, name='usage', stop_event=self.stop_event)
+            if failed:
+                self.logger.error("%s Assets failed to process", failed)
+        finally:
+            self._shutdown_consumption_pool()
+
+    @context_log
+    def dispatch(self, request):
+        with self.summary.track(request) as outcome:
+            outcome[0] = super(UsageAutomation, self).dispatch(request)
+        return outcome[0]
 
     def _format_usage_record_id(self, subscription_id, report_time, mpn):
         return "{}-{}-{}".format(subscription_id, report_time.isoformat(), mpn)
 
+    def _create_usage_file(self, usage_file):
+        with metrics.CONNECT_DURATION.time(operation='create_usage_file'):
+            return super(UsageAutomation, self)._create_usage_file(usage_file)
+
+    def _upload_usage_records(self, usage_file, usage_records):
+        """Stream usage records to spreadsheet in temporary file and upload it
+
+        Spreadsheet is written in write-only mode, so rows are not kept in
+        memory, and it is spooled to disk when it exceeds usage_spool_size.
+        """
+        spool_size = self.config.misc.get('usage_spool_size', 10 * 1024 * 1024)
+        with SpooledTemporaryFile(max_size=spool_size) as spool:
+            with profiling.span('write_usage_spreadsheet'):
+                write_usage_spreadsheet(spool, usage_records)
+            self._upload_spreadsheet_file(usage_file, spool)
+
+    def _upload_spreadsheet_file(self, usage_file, fileobj):
+        """Upload spreadsheet file to usage file
+
+        Unlike _upload_spreadsheet of SDK, the file is not read to memory, it
+        is sent in chunks as body of multipart request.
+        """
+        body = MultipartFile('usage_file', 'usage_file.xlsx', fileobj)
+        url = '{}usage/files/{}/upload/'.format(self.config.api_url, usage_file.id)
+        headers = self._api.headers
+        headers['Accept'] = 'application/json'
+        headers['Content-Type'] = body.content_type
+        self.logger.info('HTTP Request: {} - {} bytes'.format(url, len(body)))
+
+        try:
+            content, status = self._api.post(url=url, headers=headers, data=body)
+        except requests.RequestException as ex:
+            raise FileCreationError('Error uploading file: {}'.format(ex))
+        self.logger.info('HTTP Code: {}'.format(status))
+        if status != 201:
+            msg = 'Unexpected server response, returned code {}'.format(status)
+            self.logger.error('{} -- Raw response: {}'.format(msg, content))
+            raise FileCreationError(msg)
+
+    @context_log
     def process_request(self, request):
         """Generate UsageFile for each active Asset"""
 
-        # store each processed request for debug
-        self.usages.append(request)
-
-        if self.test_marketplace_requests_filter(Config.get_instance(), request.id, request.marketplace):
+        # Assets of other Marketplaces are excluded by listing query of runners, the check is kept for other callers
+        if self.test_marketplace_requests_filter(self.config, request.id, request.marketplace):
             return
 
         subscription_id = request.id
-        if not self.is_resource_exist(subscription_id):
+        current_date = datetime.utcnow()
+        if self.is_usage_reported(subscription_id, current_date):
+            self.logger.debug("%s: usage report for current period is already submitted", request.id)
+            return
+
+        try:
+            with self.backend_calls:
+                resource_exists = breaker.backend.call(self.is_resource_exist, subscription_id)
+        except breaker.BackendUnavailable:
+            # usage of the Asset is reported by the next run
+            self.logger.warning("%s: usage report is deferred because backend is unavailable", request.id)
+            return
+        if not resource_exists:
             self.logger.warning("Can't find resources for subscription {} on backend".format(subscription_id))
             return
 
@@ -50,21 +160,10 @@ class UsageAutomation(resources.UsageAutomation, ConnectorMixin):
 
         name_format = '{asset}_{date}'
         description_format = 'Report for {asset} {date}'
-        current_date = datetime.utcnow()
-        search_criteria = name_format.format(asset=subscription_id, date=current_date.strftime('%Y-%m-*'))
-
-        usage_files = UsageFileAutomation()
-        filters = Query().like('name', search_criteria)
-        if self.config.products:
-            filters.in_('product_id', self.config.products)
-        found = usage_files.list(filters)
-        found = [f for f in found or [] if f.status != 'deleted' and f.status != 'draft']
 
         current_report_name = None
-        if found:
-            found = sorted(found, key=lambda rep: time.mktime(rep.events.uploaded.at.timetuple()))
-            report = found[-1]
-
+        report = self.get_last_usage_report(subscription_id, current_date)
+        if report:
             if report.status == 'accepted':
                 current_report_name = report.name
                 rex = r"\s+(?=\d{2}(?:\d{2})?-\d{1,2}-\d{1,2}\b)"
@@ -72,6 +171,7 @@ class UsageAutomation(resources.UsageAutomation, ConnectorMixin):
                 report_time = datetime.strptime(report_time, '%Y-%m-%d %H:%M:%S')
                 start_report_time = report_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
                 end_report_time = start_report_time + timedelta(hours=1)
+                self.save_usage_state(subscription_id, report.name, start_report_time, report.status)
                 if not self.is_report_suspended_needed() and start_check_from and start_check_from > start_report_time:
                     self.logger.info("start_check_from: {} > start_report_time {}, looks like subscription was "
                                      "resumed after suspend, skipping this perood and start"
@@ -100,77 +200,337 @@ class UsageAutomation(resources.UsageAutomation, ConnectorMixin):
             return
 
         report_name = name_format.format(asset=request.id, date=start_report_time.strftime('%Y-%m-%d_%Hh'))
-        report_description = description_format.format(asset=request.id,
-                                                       date=start_report_time.strftime('%Y-%m-%d %H:%M:%S'))
 
         if current_report_name and current_report_name == report_name:
             self.logger.info("%s: usage report '%s' for current period already provided, skipping...", request.id,
                              report_name)
             return
 
-        usage_file = self.create_usage_file(
-            report_name,
-            report_description,
-            request,
-            start_report_time,
-            end_report_time
-        )
-
-        # report for each hour since last report date
-        self.logger.info("%s-%s: creating report from %s to %s", request.id, subscription_id, start_report_time,
-                         end_report_time)
+        report_periods = [(start_report_time, end_report_time)]
+        if current_report_name:
+            # catch up on missed hours since the last accepted report
+            max_reports = self.config.misc.get('usage_catchup_max_reports', 24)
+            while len(report_periods) < max_reports and \
+                    report_periods[-1][1] + timedelta(hours=1) <= current_date:
+                report_periods.append((report_periods[-1][1], report_periods[-1][1] + timedelta(hours=1)))
+            if len(report_periods) > 1:
+                self.logger.info("%s: catching up %s missed usage reports", request.id, len(report_periods))
+
         items = {item.mpn: item for item in request.items}
-        usage_records = self.collect_usage_records(items, subscription_id, start_report_time, end_report_time)
-        if usage_records:
-            self.submit_usage(usage_file=usage_file, usage_records=usage_records)
+        for start_report_time, end_report_time in report_periods:
+            report_name = name_format.format(asset=request.id, date=start_report_time.strftime('%Y-%m-%d_%Hh'))
+            report_description = description_format.format(asset=request.id,
+                                                           date=start_report_time.strftime('%Y-%m-%d %H:%M:%S'))
+
+            # Asset could be taken by another node after it was listed
+            if self.shard is not None and not self.shard.claim(request.id, report_name):
+                self.logger.info("%s: usage report '%s' is processed by another node", request.id, report_name)
+                return
+
+            submitted = False
+            try:
+                usage_file = self.create_usage_file(
+                    report_name,
+                    report_description,
+                    request,
+                    start_report_time,
+                    end_report_time
+                )
+
+                # report for each hour since last report date
+                self.logger.info("%s-%s: creating report from %s to %s", request.id, subscription_id,
+                                 start_report_time, end_report_time)
+                # usage file is created in Connect by submit_usage after consumption
+                # is collected, so Connect slot is not held while backend is queried
+                try:
+                    with profiling.span('collect_usage_records'):
+                        usage_records = list(
+                            self.collect_usage_records(items, subscription_id, start_report_time, end_report_time))
+                except breaker.BackendUnavailable:
+                    self.logger.warning("%s: usage report is deferred because backend is unavailable", request.id)
+                    return
+                if usage_records:
+                    with self.connect_calls, metrics.CONNECT_DURATION.time(operation='submit_usage'):
+                        self.submit_usage(usage_file=usage_file, usage_records=usage_records)
+                    submitted = True
+                    self.save_usage_state(subscription_id, report_name, end_report_time, 'submitted')
+            finally:
+                # report which is not submitted can be created by another node
+                if self.shard is not None:
+                    if submitted:
+                        self.shard.confirm(report_name)
+                    else:
+                        self.shard.release(report_name)
+
+    def open_usage_state(self, state_db):
+        """Open local usage state, usage is reported without it if the database cannot be opened"""
+        try:
+            return UsageReportState(state_db)
+        except Exception as e:
+            self.logger.warning("Local usage state is not used, %s cannot be opened: %s", state_db, e)
+            return None
+
+    def is_usage_reported(self, subscription_id, current_date):
+        """Check in local state that usage of the last closed hour is already reported"""
+
+        if self.usage_state is None:
+            return False
+        last_report = self.usage_state.get_last_report(subscription_id)
+        return last_report is not None and \
+            last_report[1] >= current_date.replace(minute=0, second=0, microsecond=0)
+
+    def save_usage_state(self, subscription_id, report_name, period_end, status):
+        if self.usage_state is not None:
+            self.usage_state.set_last_report(subscription_id, report_name, period_end, status)
+
+    def reset_usage_reports(self):
+        """Forget usage reports prefetched by previous run"""
+        with self._usage_reports_lock:
+            self.usage_reports = None
+            self.usage_reports_month = None
+            self.usage_report_lookups = 0
+
+    def get_prefetched_usage_reports(self, current_date):
+        """Return usage reports of the month prefetched by this run or None if the Asset is looked up alone
+
+        Usage reports are prefetched when the run needs more than
+        usage_prefetch_min_lookups lookups. Assets with usage reported in
+        local state do not need lookups, without local state all Assets do, so
+        reports are prefetched at the first lookup.
+        """
+        month = current_date.strftime('%Y-%m')
+        min_lookups = self.config.misc.get('usage_prefetch_min_lookups', 10) if self.usage_state is not None else 0
+        with self._usage_reports_lock:
+            if self.usage_reports is None or self.usage_reports_month != month:
+                self.usage_report_lookups += 1
+                if self.usage_report_lookups <= min_lookups:
+                    return None
+                self.prefetch_usage_reports(current_date)
+            return self.usage_reports
+
+    def prefetch_usage_reports(self, current_date=None):
+        """Index the latest usage report of the current month for each Asset
+
+        All usage files of the month are listed page by page, so a run needs
+        one listing request per page instead of one request per Asset.
+        """
+        current_date = current_date or datetime.utcnow()
+        page_size = self.config.misc.get('usage_files_page_size', 1000)
+
+        usage_files = self.usage_files
+        filters = Query().like('name', '*_{}'.format(current_date.strftime('%Y-%m-*')))
+        if self.config.products:
+            filters.in_('product_id', self.config.products)
+        filters.ordering(['created']).limit(page_size)
+
+        reports = {}
+        offset = 0
+        while True:
+            page = usage_files.list(filters.offset(offset)) or []
+            for report in page:
+                if not self._is_usage_report_valid(report):
+                    continue
+                asset_id = report.name.rsplit('_', 2)[0]
+                last_report = reports.get(asset_id)
+                if last_report is None or self._usage_report_order(report) >= \
+                        self._usage_report_order(last_report):
+                    reports[asset_id] = report
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+        self.logger.info("%s usage reports of %s are prefetched for %s Assets",
+                         offset + len(page), current_date.strftime('%Y-%m'), len(reports))
+        self.usage_reports = reports
+        self.usage_reports_month = current_date.strftime('%Y-%m')
+        return reports
+
+    def get_last_usage_report(self, subscription_id, current_date):
+        """Return the latest usage report of the current month for the Asset"""
+
+        reports = self.get_prefetched_usage_reports(current_date)
+        if reports is not None:
+            return reports.get(subscription_id)
+
+        search_criteria = '{asset}_{date}'.format(asset=subscription_id, date=current_date.strftime('%Y-%m-*'))
+        usage_files = self.usage_files
+        filters = Query().like('name', search_criteria)
+        if self.config.products:
+            filters.in_('product_id', self.config.products)
+        with self.connect_calls:
+            found = usage_files.list(filters)
+        found = [f for f in found or [] if self._is_usage_report_valid(f)]
+        if not found:
+            return None
+        return max(found, key=self._usage_report_order)
+
+    @staticmethod
+    def _is_usage_report_valid(report):
+        return report.status != 'deleted' and report.status != 'draft'
+
+    @staticmethod
+    def _usage_report_uploaded_at(report):
+        return time.mktime(report.events.uploaded.at.timetuple())
+
+    @classmethod
+    def _usage_report_order(cls, report):
+        # reports created by catch up in one run are uploaded in the same second,
+        # they are ordered by period in name <asset>_<YYYY-MM-DD>_<HH>h
+        return cls._usage_report_uploaded_at(report), report.name.split('_', 1)[-1]
 
     def collect_usage_records(self, items, subscription_id, start_time, end_time):
         """Create UsageRecord object for each type of resources"""
         consumptions = self.consumptions
-        conf = Config.get_instance()
+        conf = self.config
 
         consumptions.update({mpn: Zero() for mpn in conf.misc.get('report_zero_usage', [])})
 
         def known_resources(item):
             return item in consumptions
 
-        def collect_item_consumption(item):
-            return self.create_record(
-                subscription_id, start_time, end_time, item,
-                consumptions.get(item).collect_consumption(subscription_id, start_time, end_time))
+        window = self.create_window(subscription_id, start_time, end_time)
 
-        return map(collect_item_consumption, filter(known_resources, items))
+        def collect_item_consumption(item):
+            consumption = consumptions.get(item)
+            with self.backend_calls, metrics.CONSUMPTION_DURATION.time(mpn=item):
+                if isinstance(consumption, Zero):
+                    value = consumption.collect_consumption(subscription_id, start_time, end_time)
+                else:
+                    value = breaker.backend.call(consumption.collect_consumption, subscription_id, start_time,
+                                                 end_time)
+            self.logger.info("add '%s' value %s", item, value)
+            return UsageRecord(window, item, value)
+
+        workers = conf.misc.get('usage_consumption_workers', 1)
+        if workers <= 1:
+            return map(collect_item_consumption, filter(known_resources, items))
+
+        return self._collect_concurrently(
+            collect_item_consumption, [mpn for mpn in items if known_resources(mpn)], consumptions, workers,
+            conf.misc.get('usage_consumption_timeout'))
+
+    def _collect_concurrently(self, collect_item_consumption, mpns, consumptions, workers, timeout):
+        """Collect consumption of all MPNs in parallel, records are returned in order of MPNs
+
+        Zero usage is resolved at once. Timeout of each collector is counted
+        from its start, so time spent in queue of the shared pool is not
+        counted, but a collector must be started in timeout after it is
+        queued. If a collector fails or does not finish in time, the error is
+        logged and FileCreationError is raised, so usage file of the Asset is
+        not created and other Assets are processed.
+        BackendUnavailable is raised if backend circuit breaker rejects a call.
+        """
+        pool = self._get_consumption_pool(workers)
+        request_id = context_data.request_id
+        parent_span = profiling.current_span()
+        # mpn -> (event set when collector is started, [start time])
+        started = {}
+
+        def collect_in_context(mpn):
+            event, started_at = started[mpn]
+            started_at.append(time.time())
+            event.set()
+            context_data.request_id = request_id
+            try:
+                with config_context(self.config), profiling.attached(parent_span):
+                    return collect_item_consumption(mpn)
+            finally:
+                context_data.request_id = None
+
+        queued_at = time.time()
+        futures = []
+        for mpn in mpns:
+            if isinstance(consumptions[mpn], Zero):
+                futures.append((mpn, None))
+            else:
+                started[mpn] = (threading.Event(), [])
+                futures.append((mpn, pool.submit(collect_in_context, mpn)))
+
+        records = []
+        failed = []
+        unavailable = False
+        for mpn, future in futures:
+            try:
+                if future is None:
+                    records.append(collect_item_consumption(mpn))
+                elif not timeout:
+                    records.append(future.result())
+                else:
+                    event, started_at = started[mpn]
+                    if not event.wait(max(queued_at + timeout - time.time(), 0)):
+                        raise FutureTimeoutError()
+                    records.append(future.result(max(started_at[0] + timeout - time.time(), 0)))
+            except FutureTimeoutError:
+                future.cancel()
+                self.logger.error("consumption of '%s' is not collected in %s seconds", mpn, timeout)
+                failed.append(mpn)
+            except breaker.BackendUnavailable:
+                unavailable = True
+            except Exception:
+                self.logger.exception("consumption of '%s' is not collected", mpn)
+                failed.append(mpn)
+
+        if unavailable:
+            raise breaker.BackendUnavailable('backend circuit breaker is open')
+        if failed:
+            raise FileCreationError('Consumption is not collected for {}'.format(', '.join(failed)))
+        return records
+
+    def _get_consumption_pool(self, workers):
+        with self._consumption_pool_lock:
+            if self._consumption_pool is None:
+                self._consumption_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='consumption')
+            return self._consumption_pool
+
+    def _shutdown_consumption_pool(self):
+        with self._consumption_pool_lock:
+            if self._consumption_pool is not None:
+                # do not wait for collectors which are timed out
+                self._consumption_pool.shutdown(wait=False)
+                self._consumption_pool = None
+
+    def create_window(self, subscription_id, start_time, end_time):
+        """Create UsageWindow shared by all records of the report period"""
+
+        return UsageWindow(subscription_id, start_time, end_time, self.usage_record_search_criteria,
+                           self._format_usage_record_id(subscription_id, end_time, ''))
 
     def create_record(self, subscription_id, start_time, end_time, mpn, value):
         """Create UsageRecord object"""
 
         self.logger.info("add '%s' value %s", mpn, value)
-        return UsageRecord(
-            usage_record_id=self._format_usage_record_id(subscription_id, end_time, mpn),
-            item_search_criteria='item.mpn',
-            item_search_value=mpn,
-            amount=value,
-            quantity=value,
-            start_time_utc=start_time.strftime('%Y-%m-%d %H:%M:%S'),
-            end_time_utc=end_time.strftime('%Y-%m-%d %H:%M:%S'),
-            asset_search_criteria=self.usage_record_search_criteria,
-            asset_search_value=subscription_id,
-        )
+        return UsageRecord(self.create_window(subscription_id, start_time, end_time), mpn, value)
 
     # Listing in not available for TestMarket, we implement
     # our own version of Asset listing using Directory API
     # to have same code for TaskMarket and production
     def list(self, filters=None):
-        """List all active Assets"""
-        from connect.resources.directory import Directory
-        filters = filters or self.filters()
-        assets = list(Directory().list_assets(filters=filters))
-
-        for a in assets:
-            # contract's marketplace is emtpy
-            # let's use from asset
-            a.contract.marketplace = a.marketplace
-            # provider is used in debug logs
-            a.provider = a.connection.provider
+        """List all active Assets
 
-        return assets
+        Assets are requested page by page and yielded as soon as their page
+        arrives, so only one page of Assets is kept in memory.
+        """
+        from connect.resources.directory import Directory
+        filters = copy(filters or self.filters())
+        page_size = self.config.misc.get('assets_page_size', 100)
+        filters.ordering(['created']).limit(page_size)
+        directory = Directory(self.config)
+
+        offset = 0
+        while True:
+            with metrics.CONNECT_DURATION.time(operation='list_assets'):
+                assets = directory.list_assets(filters=filters.offset(offset)) or []
+
+            for a in assets:
+                if self.shard is not None and not self.shard.owns(a.id):
+                    continue
+                # contract's marketplace is emtpy
+                # let's use from asset
+                a.contract.marketplace = a.marketplace
+                # provider is used in debug logs
+                a.provider = a.connection.provider
+                yield a
+
+            if len(assets) < page_size:
+                break
+            offset += page_size
@@ -8,30 +8,73 @@ from connect import resources
 from connect.exceptions import SubmitUsageFile, AcceptUsageFile, SkipRequest, DeleteUsageFile
 
 from cloudblue_connector_backend.connector import ConnectorMixin
-from cloudblue_connector.core.logger import context_log
+from cloudblue_connector.core import metrics
+from cloudblue_connector.core.concurrency import run_in_pool, run_sequentially
+from cloudblue_connector.core.logger import ContextLoggerMixin, context_log
+from cloudblue_connector.core.sharding import create_shard
+from cloudblue_connector.core.summary import RunSummary
 
 
-class UsageFileAutomation(resources.UsageFileAutomation, ConnectorMixin):
+class UsageFileAutomation(ContextLoggerMixin, resources.UsageFileAutomation, ConnectorMixin):
     """Automates workflow of Usage Files."""
 
-    files = []
+    def __init__(self, *args, **kwargs):
+        super(UsageFileAutomation, self).__init__(*args, **kwargs)
+        self.summary = RunSummary(self.__class__.__name__)
+        # set by daemon to stop taking new UsageFiles on shutdown
+        self.stop_event = None
+        self._shard = None
+        self._shard_created = False
+
+    @property
+    def shard(self):
+        """Partition of Assets processed by this node, None if sharding is not enabled
+
+        It is created at first use, so engines which only list usage files
+        (e.g. one of usage service) do not open shard store.
+        """
+        if not self._shard_created:
+            self._shard = create_shard(self.config.misc)
+            self._shard_created = True
+        return self._shard
+
+    def process(self, filters=None):
+        """Process all UsageFiles, concurrently if usage_files_workers is configured"""
+
+        workers = self.config.misc.get('usage_files_workers', 1)
+        if self.shard is not None:
+            self.shard.refresh()
+        if workers <= 1:
+            run_sequentially(self.dispatch, self.list(filters), self.stop_event)
+            return
+
+        self.logger.info("Processing UsageFiles with %s workers", workers)
+        run_in_pool(self.dispatch, self.list(filters), workers, name='usage-files', stop_event=self.stop_event)
+        self.logger.info("%s", self.summary)
+
+    def list(self, filters=None):
+        with metrics.CONNECT_DURATION.time(operation='list_usage_files'):
+            return super(UsageFileAutomation, self).list(filters)
 
     @context_log
     def dispatch(self, request):
-        try:
-            super(UsageFileAutomation, self).dispatch(request)
-        except Exception:
-            # the error is ignored because we don't want to fail processing
-            # of other UsageFiles
-            self.logger.exception('Error occurs while dispatching request')
+        # UsageFiles are named <asset>_<YYYY-MM-DD>_<HH>h, they are processed by the node owning the Asset
+        if self.shard is not None and not self.shard.owns(request.name.rsplit('_', 2)[0]):
+            return 'skip'
+        with self.summary.track(request) as outcome:
+            try:
+                with metrics.CONNECT_DURATION.time(operation='usage_file_action'):
+                    outcome[0] = super(UsageFileAutomation, self).dispatch(request)
+            except Exception:
+                # the error is ignored because we don't want to fail processing
+                # of other UsageFiles
+                outcome[0] = 'error'
+                self.logger.exception('Error occurs while dispatching request')
         return 'skip'
 
     def process_request(self, request):
         """Confirm all UsageFiles that has 'ready' status"""
 
-        # store all processed requests for debug
-        self.files.append(request)
-
         if request.status == 'ready':
             raise SubmitUsageFile()
         elif request.status == 'pending':
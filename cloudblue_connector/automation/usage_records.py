@@ -0,0 +1,166 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import uuid
+
+# columns of usage file spreadsheet and attributes of UsageRecord of Connect SDK,
+# in the same order as they are written by UsageAutomation._create_spreadsheet of SDK
+USAGE_COLUMNS = (
+    ('record_id', 'usage_record_id'),
+    ('record_note', 'usage_record_note'),
+    ('item_search_criteria', 'item_search_criteria'),
+    ('item_search_value', 'item_search_value'),
+    ('amount', 'amount'),
+    ('quantity', 'quantity'),
+    ('start_time_utc', 'start_time_utc'),
+    ('end_time_utc', 'end_time_utc'),
+    ('asset_search_criteria', 'asset_search_criteria'),
+    ('asset_search_value', 'asset_search_value'),
+    ('item_name', 'item_name'),
+    ('item_mpn', 'item_npm'),
+    ('item_precision', 'item_precision'),
+    ('category_id', 'category_id'),
+    ('asset_recon_id', 'asset_recon_id'),
+    ('tier', 'tier'),
+)
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class UsageWindow(object):
+    """Report period of a subscription, its strings are formatted once for all records"""
+
+    __slots__ = ('subscription_id', 'asset_search_criteria', 'start_time_utc', 'end_time_utc', 'record_id_prefix')
+
+    def __init__(self, subscription_id, start_time, end_time, asset_search_criteria, record_id_prefix):
+        self.subscription_id = subscription_id
+        self.asset_search_criteria = asset_search_criteria
+        self.start_time_utc = start_time.strftime(TIME_FORMAT)
+        self.end_time_utc = end_time.strftime(TIME_FORMAT)
+        # usage record id is the prefix followed by MPN
+        self.record_id_prefix = record_id_prefix
+
+
+class UsageRecord(object):
+    """Usage of one MPN in a window
+
+    Compact replacement of UsageRecord of Connect SDK, it has the same
+    attributes used to write usage file, but keeps only the MPN, the value and
+    the shared window.
+    """
+
+    __slots__ = ('window', 'item_search_value', 'amount')
+
+    item_search_criteria = 'item.mpn'
+    usage_record_note = None
+    item_name = None
+    item_npm = None
+    item_precision = None
+    category_id = None
+    asset_recon_id = None
+    tier = None
+
+    def __init__(self, window, mpn, value):
+        self.window = window
+        self.item_search_value = mpn
+        self.amount = value
+
+    @property
+    def usage_record_id(self):
+        return self.window.record_id_prefix + self.item_search_value
+
+    @property
+    def quantity(self):
+        return self.amount
+
+    @property
+    def start_time_utc(self):
+        return self.window.start_time_utc
+
+    @property
+    def end_time_utc(self):
+        return self.window.end_time_utc
+
+    @property
+    def asset_search_criteria(self):
+        return self.window.asset_search_criteria
+
+    @property
+    def asset_search_value(self):
+        return self.window.subscription_id
+
+    def row(self):
+        window = self.window
+        return (window.record_id_prefix + self.item_search_value, None, 'item.mpn', self.item_search_value,
+                self.amount, self.amount, window.start_time_utc, window.end_time_utc, window.asset_search_criteria,
+                window.subscription_id, None, None, None, None, None, None)
+
+
+def record_row(record):
+    if isinstance(record, UsageRecord):
+        return record.row()
+    return tuple(getattr(record, attribute, None) for _, attribute in USAGE_COLUMNS)
+
+
+def write_usage_spreadsheet(fileobj, usage_records):
+    """Write usage file spreadsheet row by row, rows are not kept in memory"""
+    from openpyxl import Workbook
+
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet('usage_records')
+    sheet.append([column for column, _ in USAGE_COLUMNS])
+    for record in usage_records:
+        sheet.append(record_row(record))
+    book.save(fileobj)
+
+
+class MultipartFile(object):
+    """Body of multipart form with one file, the file is read in chunks while the body is sent
+
+    Size of the body is known in advance, so it is sent with Content-Length
+    and the file is not loaded to memory.
+    """
+
+    def __init__(self, field, filename, fileobj):
+        self.boundary = uuid.uuid4().hex
+        head = ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n\r\n'.format(
+            self.boundary, field, filename)).encode('utf-8')
+        tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        fileobj.seek(0, os.SEEK_END)
+        self.size = len(head) + fileobj.tell() + len(tail)
+        fileobj.seek(0)
+        self.parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self.part = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self.size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Rewind the body, so it can be sent again"""
+        if offset != 0 or whence != os.SEEK_SET:
+            raise io.UnsupportedOperation('body can be rewound only to the beginning')
+        for part in self.parts:
+            part.seek(0)
+        self.part = 0
+        return 0
+
+    def read(self, size=-1):
+        chunks = []
+        while self.part < len(self.parts) and size != 0:
+            chunk = self.parts[self.part].read(size)
+            if not chunk:
+                self.part += 1
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
@@ -0,0 +1,236 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from cloudblue_connector.core import metrics
+
+LOG = logging.getLogger("breaker")
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of backend call while circuit breaker is open"""
+
+
+def transport_errors():
+    """Exception types of connection errors and timeouts"""
+    errors = (ConnectionError, TimeoutError, socket.timeout, FutureTimeoutError)
+    # exceptions of requests package can be raised only if backend has imported it
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        errors += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    return errors
+
+
+def is_failure(e):
+    """Check that exception shows backend is unavailable: connection error, timeout or server error (5xx)
+
+    Other exceptions are errors of a request (bad data, bugs, Connect
+    exceptions like SkipRequest), so a few bad requests do not open the
+    circuit for all of them.
+    """
+    if isinstance(e, transport_errors()):
+        return True
+    for source in (e, getattr(e, 'response', None)):
+        for attribute in ('status_code', 'http_status', 'status'):
+            status = getattr(source, attribute, None)
+            if isinstance(status, int) and status >= 500:
+                return True
+    return False
+
+
+class BreakerState(object):
+    """Local store of circuit breaker state, so it survives process restart"""
+
+    state_db = '/var/lib/cloudblue-connector/breaker.sqlite3'
+
+    def __init__(self, state_db=None):
+        self.state_db = state_db or self.state_db
+        state_dir = os.path.dirname(self.state_db)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir, 0o700)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.state_db, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS breakers (
+                                    name TEXT PRIMARY KEY,
+                                    state TEXT NOT NULL,
+                                    opened_at REAL NOT NULL,
+                                    updated_at REAL NOT NULL
+                                    );""")
+            self.conn.commit()
+
+    def get(self, name):
+        """Return (state, opened at) or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT state, opened_at FROM breakers WHERE name=?', (name,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, name, state, opened_at):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO breakers(name, state, opened_at, updated_at) VALUES(?, ?, ?, ?)',
+                              (name, state, opened_at, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CircuitBreaker(object):
+    """Circuit breaker around backend calls
+
+    Outcomes of the last window calls are tracked. When at least min_calls
+    are made and the rate of failed or slow (longer than slow_call seconds)
+    calls reaches failure_rate, the circuit opens and calls are rejected with
+    BackendUnavailable for open_time seconds. Then one probe call is let
+    through (half-open): its success closes the circuit, its failure opens it
+    again. Open state is saved to local store, so next runs and other runners
+    skip backend which is known to be down.
+    """
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, slow_call=None, open_time=60, store=None):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_time = open_time
+        self.store = store
+        self.lock = threading.Lock()
+        self.outcomes = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0
+        self.probing = False
+        self.refresh()
+
+    def refresh(self):
+        """Take state saved by other runners, called at the beginning of each run"""
+        saved = self.store.get(self.name) if self.store is not None else None
+        with self.lock:
+            if saved is not None and saved != (self.state, self.opened_at):
+                state, opened_at = saved
+                # probe of another process may be lost, circuit is taken as open since the same time
+                self.set_state(OPEN if state == HALF_OPEN else state, opened_at, save=False)
+            elif saved is None:
+                metrics.BACKEND_BREAKER_STATE.set(STATE_VALUES[self.state], name=self.name)
+
+    def set_state(self, state, opened_at=None, save=True):
+        if state != self.state:
+            LOG.warning('Circuit breaker of %s is %s', self.name, state.replace('_', '-'))
+            # outcomes of calls made before the circuit was opened are not counted again
+            self.outcomes.clear()
+        self.state = state
+        if opened_at is not None:
+            self.opened_at = opened_at
+        if state != HALF_OPEN:
+            self.probing = False
+        metrics.BACKEND_BREAKER_STATE.set(STATE_VALUES[state], name=self.name)
+        if save and self.store is not None:
+            try:
+                self.store.set(self.name, state, self.opened_at)
+            except Exception:
+                LOG.exception('State of circuit breaker %s is not saved', self.name)
+
+    def is_open(self):
+        """Check that calls are rejected now, probe is not taken"""
+        with self.lock:
+            if self.state == OPEN:
+                return time.time() < self.opened_at + self.open_time
+            return self.state == HALF_OPEN and self.probing
+
+    def allow(self):
+        """Check that a call can be made, in half-open state only one probe call is allowed"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() < self.opened_at + self.open_time:
+                    return False
+                self.set_state(HALF_OPEN)
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, failed, duration):
+        """Record outcome of a call allowed by allow()"""
+        failed = failed or bool(self.slow_call and duration > self.slow_call)
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self.set_state(OPEN, time.time())
+                else:
+                    self.set_state(CLOSED)
+                return
+            if self.state != CLOSED:
+                # call was started before the circuit opened
+                return
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= self.min_calls and \
+                    sum(self.outcomes) >= self.failure_rate * len(self.outcomes):
+                self.set_state(OPEN, time.time())
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the breaker, raise BackendUnavailable if circuit is open"""
+        if not self.allow():
+            raise BackendUnavailable('{} is unavailable, circuit breaker is open'.format(self.name))
+        started = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(is_failure(e), time.time() - started)
+            raise
+        self.record(False, time.time() - started)
+        return result
+
+
+# breaker of backend calls shared by all automation engines of the process
+backend = CircuitBreaker('backend')
+backend_options = None
+lock = threading.Lock()
+
+
+def install(misc):
+    """Configure breaker of backend calls with misc options, it is replaced only if options are changed"""
+    global backend, backend_options
+
+    options = (
+        misc.get('backend_breaker_window', 20),
+        misc.get('backend_breaker_min_calls', 5),
+        misc.get('backend_breaker_failure_rate', 0.5),
+        misc.get('backend_breaker_slow_call'),
+        misc.get('backend_breaker_open_time', 60),
+        misc.get('backend_breaker_state_db', BreakerState.state_db),
+    )
+    with lock:
+        if backend_options == options:
+            return backend
+        window, min_calls, failure_rate, slow_call, open_time, state_db = options
+        store = None
+        if state_db:
+            try:
+                store = BreakerState(state_db)
+            except Exception:
+                LOG.exception('State of circuit breaker is not stored in %s', state_db)
+        backend = CircuitBreaker('backend', window, min_calls, failure_rate, slow_call, open_time, store)
+        backend_options = options
+    return backend
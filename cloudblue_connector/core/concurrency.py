@@ -0,0 +1,196 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger("concurrency")
+
+
+class NoLimit(object):
+    """Context manager used in place of a semaphore when no limit is set"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def limiter(limit):
+    """Return context manager which limits number of concurrent calls"""
+    if limit and limit > 0:
+        return threading.BoundedSemaphore(limit)
+    return NoLimit()
+
+
+def run_in_pool(func, items, workers, name='worker', stop_event=None):
+    """Call func for each item using a bounded pool of threads
+
+    Items are taken from the iterable lazily, so not more than twice the
+    number of workers are in flight. An exception raised for one item is
+    logged and does not stop processing of other items. When stop_event is
+    set, items which are not taken yet are left and running ones are finished.
+    Return the number of failed items.
+    """
+    slots = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    failed = [0]
+
+    def call(item):
+        try:
+            func(item)
+        except Exception:
+            LOG.exception('Error occurs while processing %s', getattr(item, 'id', item))
+            with lock:
+                failed[0] += 1
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        for item in items:
+            slots.acquire()
+            if stop_event is not None and stop_event.is_set():
+                slots.release()
+                break
+            pool.submit(call, item)
+
+    return failed[0]
+
+
+def run_sequentially(func, items, stop_event=None):
+    """Call func for each item one by one, items are taken from the iterable lazily
+
+    When stop_event is set, items which are not started are left. Exceptions
+    are not handled. Return the number of processed items.
+    """
+    processed = 0
+    for item in items:
+        if stop_event is not None and stop_event.is_set():
+            LOG.info('Processing is stopped, %s items are processed', processed)
+            break
+        func(item)
+        processed += 1
+    return processed
+
+
+def call_with_timeout(func, item, timeout, name, outstanding=None):
+    """Call func in a separate thread and wait for it not more than timeout seconds
+
+    Return (True, result of func) if func is finished or (False, None). A call
+    which is not finished in time continues in background, it cannot be
+    interrupted. Its thread is not a daemon one, so the process does not exit
+    in the middle of the call, and it is added to outstanding list to be
+    joined by the caller.
+    """
+    error = []
+    result = []
+
+    def target():
+        try:
+            result.append(func(item))
+        except Exception as e:
+            error.append(e)
+
+    thread = threading.Thread(target=target, name=name)
+    thread.start()
+    thread.join(timeout)
+    if error:
+        raise error[0]
+    if thread.is_alive():
+        if outstanding is not None:
+            outstanding.append(thread)
+        return False, None
+    return True, result[0]
+
+
+def run_ordered(func, items, key, stop_event=None):
+    """Call func for each item one by one, items are taken from the iterable lazily
+
+    If func fails or returns False for an item, following items with the same
+    key are skipped, as in run_ordered_in_pool. When stop_event is set, items
+    which are not started are skipped.
+    Return the number of failed items.
+    """
+    failed_keys = set()
+    for item in items:
+        if stop_event is not None and stop_event.is_set():
+            break
+        item_key = key(item)
+        item_id = getattr(item, 'id', item)
+        if item_key in failed_keys:
+            LOG.info('%s is skipped because previous item of %s is not processed', item_id, item_key)
+            continue
+        try:
+            completed = func(item) is not False
+        except Exception:
+            LOG.exception('Error occurs while processing %s, other items of %s are skipped', item_id, item_key)
+            completed = False
+        else:
+            if not completed:
+                LOG.error('%s is not processed, other items of %s are skipped', item_id, item_key)
+        if not completed:
+            failed_keys.add(item_key)
+    return len(failed_keys)
+
+
+def run_ordered_in_pool(func, items, key, workers, timeout=None, name='worker', stop_event=None):
+    """Call func for each item concurrently, items with the same key are processed one by one
+
+    Items with the same key are processed in their order. If func fails or
+    returns False for an item, or the item is not processed in timeout
+    seconds, the rest of items with the same key are skipped, so they are not
+    processed before or together with it.
+    Items which are not processed in time are still waited for before
+    return, so they are not left half done.
+    When stop_event is set, items which are not started are skipped and
+    running ones are finished.
+    Return the number of failed items.
+    """
+    groups = collections.OrderedDict()
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+
+    lock = threading.Lock()
+    failed = [0]
+    outstanding = []
+
+    def call_group(group_key, group):
+        for item in group:
+            if stop_event is not None and stop_event.is_set():
+                return
+            item_id = getattr(item, 'id', item)
+            try:
+                if timeout:
+                    finished, result = call_with_timeout(func, item, timeout, '{}-{}'.format(name, item_id),
+                                                         outstanding)
+                else:
+                    finished, result = True, func(item)
+            except Exception:
+                LOG.exception('Error occurs while processing %s, other items of %s are skipped', item_id, group_key)
+                finished, result = False, False
+            else:
+                if not finished:
+                    LOG.error('%s is not processed in %s seconds, other items of %s are skipped',
+                              item_id, timeout, group_key)
+                elif result is False:
+                    LOG.error('%s is not processed, other items of %s are skipped', item_id, group_key)
+            if not finished or result is False:
+                with lock:
+                    failed[0] += 1
+                return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        for group_key, group in groups.items():
+            pool.submit(call_group, group_key, group)
+
+    if outstanding:
+        LOG.warning('Waiting for %s items which are not processed in %s seconds', len(outstanding), timeout)
+        for thread in outstanding:
+            thread.join()
+    return failed[0]
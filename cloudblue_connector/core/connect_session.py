@@ -0,0 +1,192 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import connect.resources.base as connect_base
+
+from cloudblue_connector.core import metrics
+from cloudblue_connector.core.rate_limit import AdaptiveRateLimiter, backoff_delay, retry_after
+
+LOG = logging.getLogger("connect_session")
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+TRANSIENT_STATUSES = (500, 502, 503, 504)
+THROTTLED = 429
+# state transitions of usage files are safe to repeat, a repeated transition
+# is rejected by status check of Connect and is not applied twice
+USAGE_FILE_TRANSITION = re.compile(r'/usage/files/[^/]+/(submit|accept|reject|delete|reprocess|close)/?$')
+
+
+def is_not_sent(e):
+    """Check that request failed before it was sent, so it can be repeated even if it is not idempotent"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def is_transient(e):
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class ConnectSession(object):
+    """Pooled HTTP session used for all CloudBlue Connect API calls
+
+    Connect SDK creates a new ApiClient for each call and sends requests with
+    module-level functions of requests package, so each call opens a new
+    connection. The session is put in place of requests package in SDK module,
+    so all ApiClients of all automation engines share one pool of keep-alive
+    connections.
+
+    Calls pass adaptive rate limiter. Throttled calls (429) are repeated after
+    Retry-After or backoff delay. Idempotent calls and usage file state
+    transitions are also repeated on server and connection errors, other calls
+    only if they were not sent.
+    """
+
+    def __init__(self, pool_size=10, retries=3, backoff=0.5, max_backoff=30.0, rate_limiter=None,
+                 transition_retries=3, transition_backoff=1.0):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transition_retries = transition_retries
+        self.transition_backoff = transition_backoff
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def prepare(self, method, url, params=None, data=None, headers=None, cookies=None, files=None, auth=None,
+                timeout=None, allow_redirects=True, proxies=None, hooks=None, stream=None, verify=None, cert=None,
+                json=None):
+        """Prepare request once, so the same body (including uploaded files) is sent by each attempt"""
+        request = requests.Request(method=method.upper(), url=url, headers=headers, files=files, data=data or {},
+                                   json=json, params=params or {}, auth=auth, cookies=cookies, hooks=hooks)
+        prepared = self.session.prepare_request(request)
+        send_kwargs = {'timeout': timeout, 'allow_redirects': allow_redirects}
+        send_kwargs.update(self.session.merge_environment_settings(prepared.url, proxies or {}, stream, verify, cert))
+        return prepared, send_kwargs
+
+    def request(self, method, url, **kwargs):
+        prepared, send_kwargs = self.prepare(method, url, **kwargs)
+        retries, backoff = self.retries, self.backoff
+        idempotent = prepared.method in IDEMPOTENT_METHODS
+        if prepared.method == 'POST' and USAGE_FILE_TRANSITION.search(prepared.path_url.split('?')[0]):
+            retries, backoff = self.transition_retries, self.transition_backoff
+            idempotent = True
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            if attempt and hasattr(prepared.body, 'seek'):
+                # body streamed from file is read by previous attempt
+                prepared.body.seek(0)
+            try:
+                response = self.session.send(prepared, **send_kwargs)
+            except requests.exceptions.RequestException as e:
+                if attempt >= retries or not (is_not_sent(e) or idempotent and is_transient(e)):
+                    raise
+                reason = e.__class__.__name__
+                delay = backoff_delay(attempt, backoff, self.max_backoff)
+            else:
+                status = response.status_code
+                if status == THROTTLED:
+                    self.rate_limiter.on_throttle(retry_after(response))
+                elif status < 500:
+                    self.rate_limiter.on_success()
+                # throttled calls are rejected before processing, so any call can be repeated
+                if attempt >= retries or not (status == THROTTLED or idempotent and status in TRANSIENT_STATUSES):
+                    return response
+                response.close()
+                reason = str(status)
+                delay = retry_after(response) or backoff_delay(attempt, backoff, self.max_backoff)
+
+            attempt += 1
+            metrics.CONNECT_RETRIES.inc(method=prepared.method, reason=reason)
+            LOG.warning('%s %s failed (%s), retry %s of %s in %.1f seconds',
+                        prepared.method, prepared.path_url, reason, attempt, retries, delay)
+            time.sleep(delay)
+
+    def __getattr__(self, name):
+        # other names used by SDK (exceptions, codes) are taken from requests package
+        return getattr(requests, name)
+
+    def connection_stats(self):
+        """Return number of opened connections and number of requests sent through them"""
+        connections = 0
+        sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                sent += pool.num_requests
+        return connections, sent
+
+    def close(self):
+        self.session.close()
+
+
+session = None
+session_options = None
+lock = threading.Lock()
+
+
+def install(misc):
+    """Send all Connect SDK requests through shared session configured with misc options"""
+    global session, session_options
+
+    options = (
+        misc.get('connect_pool_size', 10),
+        misc.get('connect_retries', 3),
+        misc.get('connect_retry_backoff', 0.5),
+        misc.get('connect_retry_max_backoff', 30.0),
+        misc.get('connect_rate_limit'),
+        misc.get('connect_min_rate', 1.0),
+        misc.get('connect_rate_increase', 0.1),
+        misc.get('usage_files_retries', 3),
+        misc.get('usage_files_retry_backoff', 1.0),
+    )
+    with lock:
+        if session is not None and session_options == options:
+            return session
+        (pool_size, retries, backoff, max_backoff, max_rate, min_rate, increase,
+         transition_retries, transition_backoff) = options
+        # previous session is not closed, calls made by running cycles can use it
+        session = ConnectSession(pool_size, retries, backoff, max_backoff,
+                                 AdaptiveRateLimiter(max_rate, min_rate=min_rate, increase=increase),
+                                 transition_retries, transition_backoff)
+        session_options = options
+        connect_base.requests = session
+    return session
+
+
+def connection_stats():
+    """Return (connections, requests) of shared session, (0, 0) if it is not installed"""
+    if session is None:
+        return 0, 0
+    return session.connection_stats()
@@ -4,8 +4,12 @@
 # ******************************************************************************
 # -*- coding: utf-8 -*-
 
+import collections
 import functools
 import logging
+import threading
+import time
+from concurrent.futures import Future
 
 LOG = logging.getLogger("decorators")
 
@@ -25,24 +29,128 @@ def once(f):
     return wrapper
 
 
-def memoize(f):
-    """Cache result of a function call with parameters"""
-    f.memory = {}
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'shared', 'evictions', 'size'])
 
-    @functools.wraps(f)
-    def wrapper(self, *args, **kwargs):
-        x = None
+
+class Cache(object):
+    """Thread-safe LRU cache of function results with optional TTL
+
+    With single_flight enabled, concurrent callers with the same key wait
+    for the first call instead of calling the function themselves.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, single_flight=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.single_flight = single_flight
+        self.data = collections.OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.shared = self.evictions = 0
+
+    @staticmethod
+    def make_key(args, kwargs):
+        key = args
+        if kwargs:
+            key += (MISSING,) + tuple(sorted(kwargs.items()))
+        hash(key)
+        return key
+
+    def call(self, f, args, kwargs):
         try:
-            x = tuple(list(args) + [])
+            key = self.make_key(args, kwargs)
         except TypeError:
-            LOG.exception('XXX')
-        rv = f.memory.get(x, MISSING)
-        if rv is MISSING:
-            rv = f(self, *args, **kwargs)
-            f.memory[x] = rv
+            LOG.debug('Result of %s is not cached, arguments are not hashable', f.__name__)
+            return f(*args, **kwargs)
+
+        with self.lock:
+            rv = self.get(key)
+            if rv is not MISSING:
+                self.hits += 1
+                return rv
+            self.misses += 1
+            in_flight = None
+            if self.single_flight:
+                in_flight = self.in_flight.get(key)
+                if in_flight is None:
+                    self.in_flight[key] = Future()
+                else:
+                    self.shared += 1
+
+        if in_flight is not None:
+            return in_flight.result()
+
+        try:
+            rv = f(*args, **kwargs)
+        except BaseException as e:
+            if self.single_flight:
+                with self.lock:
+                    self.in_flight.pop(key).set_exception(e)
+            raise
+
+        with self.lock:
+            self.set(key, rv)
+            in_flight = self.in_flight.pop(key, None)
+        if in_flight is not None:
+            in_flight.set_result(rv)
         return rv
 
-    return wrapper
+    def get(self, key):
+        item = self.data.get(key, MISSING)
+        if item is MISSING:
+            return MISSING
+        expires_at, rv = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            self.evictions += 1
+            return MISSING
+        self.data.move_to_end(key)
+        return rv
+
+    def set(self, key, rv):
+        self.data[key] = (time.monotonic() + self.ttl if self.ttl else None, rv)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *args, **kwargs):
+        """Remove cached result of the call with given arguments"""
+        with self.lock:
+            self.data.pop(self.make_key(args, kwargs), None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.shared, self.evictions, len(self.data))
+
+
+def cached(maxsize=128, ttl=None, single_flight=False):
+    """Cache result of a function call with parameters
+
+    Results are evicted when there are more than maxsize of them or after ttl
+    seconds. For methods instance is a part of the key. Cache is available as
+    wrapper.cache, e.g. f.cache.invalidate(self, x), f.cache.info().
+    """
+
+    def decorator(f):
+        cache = Cache(maxsize, ttl, single_flight)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            return cache.call(f, args, kwargs)
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+# bounded replacement of unbounded per-function memory
+memoize = cached(maxsize=1024, ttl=600)
 
 
 def log_exception(f):
@@ -4,28 +4,189 @@
 # ******************************************************************************
 # -*- coding: utf-8 -*-
 
+import atexit
 import json
 import logging
 import os
+import queue
 import re
 import threading
-from functools import wraps
-from logging.config import dictConfig
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener
 
-from connect.config import Config
-from connect.logger import logger
+from cloudblue_connector.core import profiling
 
-# Configure logging /etc/cloudblue_connector/config-logging.json
-if os.path.exists('/etc/cloudblue-connector/config-logging.json'):
-    with open('/etc/cloudblue-connector/config-logging.json') as config_log_file:
-        settings = json.load(config_log_file)
-        dictConfig(settings['logging'])
+LOGGING_CONFIG_FILE = '/etc/cloudblue-connector/config-logging.json'
 
-# Set connect log level / default level ERROR
-logger.setLevel('DEBUG')
+LOG = logging.getLogger()
 
-context_data = threading.local()
-context_data.request_id = None
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queue handler which does not block logging thread when queue is full.
+
+    Overflow policies:
+     - drop_debug - DEBUG records are dropped when queue is filled above
+       debug_watermark, INFO and WARNING records are dropped when queue is
+       full, ERROR and CRITICAL records wait for free space.
+     - drop - any record is dropped when queue is full.
+     - block - logging thread waits for free space.
+    """
+
+    def __init__(self, queue_size=10000, overflow='drop_debug', debug_watermark=0.8):
+        super(BoundedQueueHandler, self).__init__(queue.Queue(queue_size))
+        self.overflow = overflow
+        self.debug_limit = int(queue_size * debug_watermark)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.overflow == 'drop_debug' and record.levelno <= logging.DEBUG \
+                and self.queue.qsize() >= self.debug_limit:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'block' or (self.overflow == 'drop_debug' and record.levelno >= logging.ERROR):
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+queue_listener = None
+
+
+def start_async_logging(queue_size=10000, overflow='drop_debug', debug_watermark=0.8):
+    """Move handlers of root logger to background thread, records are passed through bounded queue"""
+    global queue_listener
+
+    stop_async_logging()
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    queue_handler = BoundedQueueHandler(queue_size, overflow, debug_watermark)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    queue_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    queue_listener.handler = queue_handler
+    queue_listener.start()
+
+
+def stop_async_logging():
+    """Write all queued records and return handlers to root logger"""
+    global queue_listener
+
+    if queue_listener is None:
+        return
+    listener, queue_listener = queue_listener, None
+    listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(listener.handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
+    if listener.handler.dropped:
+        root.warning("%s log records were dropped because logging queue was full", listener.handler.dropped)
+
+
+atexit.register(stop_async_logging)
+
+
+def configure_logging():
+    """Configure logging from /etc/cloudblue-connector/config-logging.json"""
+    if os.path.exists(LOGGING_CONFIG_FILE):
+        from logging.config import dictConfig
+
+        with open(LOGGING_CONFIG_FILE) as config_log_file:
+            settings = json.load(config_log_file)
+            stop_async_logging()
+            dictConfig(settings['logging'])
+            async_settings = settings.get('async_logging', {})
+            if async_settings.get('enabled'):
+                start_async_logging(
+                    async_settings.get('queue_size', 10000),
+                    async_settings.get('overflow', 'drop_debug'),
+                    async_settings.get('debug_watermark', 0.8))
+
+
+# external loggers which get context filter in init_logging()
+ext_loggers = ["keystoneauth.session", "decorators"]
+
+logging_initialized = False
+init_lock = threading.Lock()
+
+
+def init_logging(reload=False):
+    """Configure logging and add filters of connector, only the first call has effect unless reload is set
+
+    It is not done on import, so processes which do not log (e.g. password
+    setters) do not read logging configuration and import Connect SDK.
+    """
+    global logging_initialized
+
+    with init_lock:
+        if logging_initialized and not reload:
+            return
+        # Connect SDK configures its logger on import, so it is imported before configuration is applied
+        from connect.logger import logger
+
+        configure_logging()
+        if not logging_initialized:
+            # Set connect log level / default level ERROR
+            logger.setLevel('DEBUG')
+
+            # Add context filter to external loggers
+            for logger_name in ext_loggers:
+                ext_logger = logging.getLogger(logger_name)
+                ext_logger.addFilter(ContextFilter())
+
+            # Add filters to root logger
+            logger.addFilter(ContextFilter())
+            logger.addFilter(PasswordFilter())
+        logging_initialized = True
+
+
+class ContextData(threading.local):
+    """Logging context, each thread processing requests has its own copy"""
+
+    request_id = None
+    # configuration of automation engine running in the thread, see use_context_config()
+    config = None
+
+
+context_data = ContextData()
+
+
+@contextmanager
+def config_context(config):
+    """Set configuration of automation engine running in the current thread"""
+    previous_config = context_data.config
+    context_data.config = config
+    try:
+        yield
+    finally:
+        context_data.config = previous_config
+
+
+def use_context_config():
+    """Make Config.get_instance() of Connect SDK return configuration of engine running in the current thread
+
+    Daemon runs engines with different configurations in one process, while
+    Connect SDK and backend take configuration from the process-wide
+    singleton, which is the first configuration created. Threads which do
+    not run an engine get the singleton.
+    """
+    from connect.config import Config
+
+    if getattr(Config.get_instance, 'uses_context', False):
+        return
+    get_instance = Config.get_instance
+
+    def context_get_instance(cls):
+        return context_data.config or get_instance()
+
+    context_get_instance.uses_context = True
+    Config.get_instance = classmethod(context_get_instance)
 
 
 class ContextFilter(logging.Filter):
@@ -42,9 +203,14 @@ class ContextFilter(logging.Filter):
 class PasswordFilter(logging.Filter):
     """
     This is a filter which wipes password information from the log record.
+
+    Records without "password" substring are passed without any regex or JSON
+    work. Payloads larger than max_payload_size are not parsed, the whole
+    message is hidden instead.
     """
 
     is_enabled = None
+    max_payload_size = 4 * 1024 * 1024
 
     type_pattern = re.compile(r'"type":\s?"password"', re.MULTILINE)
     password_patterns = [
@@ -52,41 +218,77 @@ class PasswordFilter(logging.Filter):
         re.compile(r'^Function\s`.*?`\sreturn:\s(.*)$', re.MULTILINE + re.DOTALL),
     ]
 
+    @staticmethod
+    def enabled():
+        if PasswordFilter.is_enabled is None:
+            from connect.config import Config
+
+            misc = Config.get_instance().misc
+            PasswordFilter.is_enabled = misc['hidePasswordsInLog']
+            PasswordFilter.max_payload_size = misc.get('hidePasswordsMaxPayloadSize', PasswordFilter.max_payload_size)
+        return PasswordFilter.is_enabled
+
+    @staticmethod
+    def may_contain_password(record):
+        """Cheap check of message and string arguments before any regex is applied"""
+        if isinstance(record.msg, str) and '"password"' in record.msg:
+            return True
+        args = record.args
+        if isinstance(args, dict):
+            args = args.values()
+        return bool(args) and any(isinstance(arg, str) and '"password"' in arg for arg in args)
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def password_matcher(passwords):
+        return re.compile("|".join(re.escape(pwd) for pwd in passwords), flags=re.M)
+
+    @staticmethod
+    def find_passwords(raw_json):
+        payload = json.loads(raw_json.replace("\\x", "\\u00"))
+        if not isinstance(payload, list):
+            payload = [payload]
+        found_passwords = set()
+        for node in payload:
+            for params in node.get('params', []), node.get('asset', {}).get('params', []):
+                for p in params:
+                    if p.get('type', None) == 'password' and p.get('value', None):
+                        found_passwords.add(p['value'])
+        return found_passwords
+
     def filter(self, record):
-        def get_function_rv():
-            if PasswordFilter.is_enabled is None:
-                PasswordFilter.is_enabled = Config.get_instance().misc['hidePasswordsInLog']
-            if PasswordFilter.is_enabled and re.search(PasswordFilter.type_pattern, record.msg):
-                msg = record.msg.replace("\n", "\\n").replace("\\'", "'")
-                for pattern in PasswordFilter.password_patterns:
-                    match = re.search(pattern, msg)
-                    if match:
-                        return match.group(1)
-                logger.warning("Message does not match against password patterns")
-            return None
-
-        raw_json = get_function_rv()
+        if not self.may_contain_password(record) or not self.enabled():
+            return True
+
+        msg = record.getMessage()
+        if not PasswordFilter.type_pattern.search(msg):
+            return True
+
+        if len(msg) > PasswordFilter.max_payload_size:
+            record.msg = "***hidden*** payload of {} bytes with passwords".format(len(msg))
+            record.args = None
+            return True
+
+        raw_json = None
+        flat_msg = msg.replace("\n", "\\n").replace("\\'", "'")
+        for pattern in PasswordFilter.password_patterns:
+            match = pattern.search(flat_msg)
+            if match:
+                raw_json = match.group(1)
+                break
         if not raw_json:
+            LOG.warning("Message does not match against password patterns")
             return True
 
         try:
-            raw_json = raw_json.replace("\\x", "\\u00")
-            payload = json.loads(raw_json)
-            if not isinstance(payload, list):
-                payload = [payload]
-            found_passwords = {}
-            for node in payload:
-                for params in node.get('params', []), node.get('asset', {}).get('params', []):
-                    for p in params:
-                        if p.get('type', None) == 'password' and p.get('value', None):
-                            pwd = re.escape(p['value'])
-                            if pwd not in found_passwords:
-                                found_passwords[pwd] = ''
-            record.msg = re.sub("|".join(found_passwords.keys()), "***hidden***", record.msg, flags=re.M)
+            found_passwords = self.find_passwords(raw_json)
+            if found_passwords:
+                record.msg = self.password_matcher(tuple(sorted(found_passwords))).sub("***hidden***", msg)
+                record.args = None
         except ValueError:
-            logger.exception("Cannot deserialize API payload. Raw data: %s", raw_json)
+            LOG.exception("Cannot deserialize API payload. Raw data: %s", raw_json)
         except Exception:
-            logger.exception("Cannot patch API payload")
+            LOG.exception("Cannot patch API payload")
         return True
 
 
@@ -98,23 +300,39 @@ def getLogger(name):
 
 
 def context_log(func):
-    """Store and clean context for logging"""
+    """Store and clean context for logging and engine configuration, record span of the request if profiling is on"""
 
     @wraps(func)
     def wrapper(self, request, *args, **kwargs):
+        previous_request_id = context_data.request_id
         context_data.request_id = request.id
-        result = func(self, request, *args, **kwargs)
-        context_data.request_id = None
-        return result
+        try:
+            with config_context(getattr(self, 'config', None) or context_data.config):
+                if profiling.profiler is None:
+                    return func(self, request, *args, **kwargs)
+                with profiling.request_span(self.__class__.__name__, func.__name__, request.id):
+                    return func(self, request, *args, **kwargs)
+        finally:
+            context_data.request_id = previous_request_id
     return wrapper
 
 
-# Add context filter to external loggers
-ext_loggers = ["keystoneauth.session", "decorators"]
-for logger_name in ext_loggers:
-    ext_logger = logging.getLogger(logger_name)
-    ext_logger.addFilter(ContextFilter())
+def request_logger(name):
+    """Return logger of the request processed by the current thread"""
+    from connect.logger import LoggerAdapter
+
+    return LoggerAdapter(logging.getLogger('{}.{}'.format(name, context_data.request_id)))
+
+
+class ContextLoggerMixin(object):
+    """Automation engine mixin which logs with request id of the current thread
+
+    Requests processed concurrently are not set as current request of the
+    engine, so logger of the current thread request is used for them.
+    """
 
-# Add filters to root logger
-logger.addFilter(ContextFilter())
-logger.addFilter(PasswordFilter())
+    @property
+    def logger(self):
+        if self._current_request is None and context_data.request_id:
+            return request_logger(self.__class__.__name__)
+        return super(ContextLoggerMixin, self).logger
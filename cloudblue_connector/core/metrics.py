@@ -0,0 +1,214 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from cloudblue_connector.core import profiling
+
+PREFIX = 'cloudblue_connector_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(n, escape_label(v)) for n, v in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry(object):
+    """Set of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        return ''.join(metric.render() for metric in metrics)
+
+    def write_textfile(self, path):
+        """Write metrics for textfile collector of node exporter
+
+        File is replaced atomically, so collector never reads partially written file.
+        """
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    """Base of metrics, values are kept per combination of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (name suffix, label names, label values, value) of each sample"""
+        with self.lock:
+            values = sorted(self.values.items(), key=str)
+        for key, value in values:
+            yield '', self.labelnames, key, value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for suffix, names, values, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, format_labels(names, values), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # name of profiling span of timed blocks, e.g. connect_call
+        self.span_name = name.replace('_duration_seconds', '')
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # counts per bucket (not cumulative), sum and count
+            value_counts = self.values.get(key)
+            if value_counts is None:
+                value_counts = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                value_counts[0][index] += 1
+            value_counts[1] += value
+            value_counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe duration of the block, including blocks which raise exception"""
+        started = time.time()
+        try:
+            with profiling.span(self.span_name, labels):
+                yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, (list(counts), total, count))
+                      for key, (counts, total, count) in sorted(self.values.items())]
+        names = self.labelnames + ('le',)
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', names, key + (bound,), cumulative
+            yield '_bucket', names, key + ('+Inf',), count
+            yield '_sum', self.labelnames, key, total
+            yield '_count', self.labelnames, key, count
+
+
+def start_http_server(port, addr='127.0.0.1', registry=REGISTRY):
+    """Serve metrics on http://addr:port/metrics from background thread"""
+    # HTTP server is imported only by processes which serve metrics
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # scrapes are not logged
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write_textfile(path):
+    REGISTRY.write_textfile(path)
+
+
+REQUESTS = Counter('requests_total', 'Number of processed requests', ('engine', 'status', 'outcome'))
+REQUEST_DURATION = Histogram('request_duration_seconds', 'Time of request processing', ('engine', 'outcome'))
+CONSUMPTION_DURATION = Histogram('consumption_duration_seconds', 'Time of consumption collection from backend',
+                                 ('mpn',))
+CONNECT_DURATION = Histogram('connect_call_duration_seconds', 'Time of CloudBlue Connect API calls',
+                             ('operation',))
+CONNECT_RETRIES = Counter('connect_retries_total', 'Number of repeated CloudBlue Connect API calls',
+                          ('method', 'reason'))
+BACKEND_ALIVE = Gauge('backend_alive', 'Result of the last backend liveness check (1 if alive)', ('engine',))
+BACKEND_CHECK_DURATION = Histogram('backend_check_duration_seconds', 'Time of backend liveness check', ('engine',))
+BACKEND_BREAKER_STATE = Gauge('backend_breaker_state',
+                              'State of backend circuit breaker (0 closed, 1 half-open, 2 open)', ('name',))
+RUN_DURATION = Gauge('run_duration_seconds', 'Duration of the last finished run', ('engine',))
+RUN_FINISHED = Gauge('run_finished_timestamp_seconds', 'Time when the last run was finished', ('engine',))
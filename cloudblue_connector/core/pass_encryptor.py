@@ -5,21 +5,80 @@
 
 import base64
 import os
-
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+import threading
 import sqlite3
 
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+# cryptography is imported by functions which use it, so processes
+# which do not decrypt passwords do not pay for its import
+
+
+def oaep_padding():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    return padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    )
+
+
+class SecretCache(object):
+    """Process-level cache of private key, database connection and decrypted passwords
+
+    Private key is reloaded when key file is modified, decrypted passwords
+    are dropped when database file is modified. Passwords are kept in memory only.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.private_key = None
+        self.private_key_mtime = None
+        self.connection = None
+        self.passwords = {}
+        self.passwords_mtime = None
+
+    def get_private_key(self, path, load):
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            if self.private_key is None or self.private_key_mtime != mtime:
+                self.private_key = load()
+                self.private_key_mtime = mtime
+                # passwords could be encrypted with another key
+                self.passwords = {}
+            return self.private_key
+
+    def get_connection(self, path):
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(path, check_same_thread=False)
+            return self.connection
+
+    def get_password(self, path, service, load):
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            if self.passwords_mtime != mtime:
+                self.passwords = {}
+                self.passwords_mtime = mtime
+            if service not in self.passwords:
+                self.passwords[service] = load()
+            return self.passwords[service]
+
+    def invalidate(self):
+        with self.lock:
+            self.passwords = {}
+            self.passwords_mtime = None
 
 
 class ConnectorPasswords(object):
     rsa_private = '/etc/cloudblue-connector/connector.pem'
     passwords_db = '/etc/cloudblue-connector/passwords_db.sqlite3'
 
+    # caches shared by all instances, one for each pair of key and database files
+    caches = {}
+    caches_lock = threading.Lock()
+
     def __init__(self):
         if not os.path.exists(self.rsa_private):
             self.generate_rsa_key()
@@ -27,8 +86,15 @@ class ConnectorPasswords(object):
         if not os.path.exists(self.passwords_db):
             self.create_database()
 
+        with self.caches_lock:
+            self.cache = self.caches.setdefault((self.rsa_private, self.passwords_db), SecretCache())
+
     def generate_rsa_key(self):
         if not os.path.exists(self.rsa_private):
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+
             private_key = rsa.generate_private_key(
                 public_exponent=65537,
                 key_size=4096,
@@ -55,6 +121,12 @@ class ConnectorPasswords(object):
         conn.close()
 
     def load_private_key(self):
+        return self.cache.get_private_key(self.rsa_private, self.read_private_key)
+
+    def read_private_key(self):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+
         with open(self.rsa_private, "rb") as key_file:
             private_key = serialization.load_pem_private_key(
                 key_file.read(),
@@ -63,52 +135,40 @@ class ConnectorPasswords(object):
             )
             return private_key
 
-
     def encode_password(self, password):
         password = bytes(password, encoding='utf-8')
         private_key = self.load_private_key()
         public_key = private_key.public_key()
 
-        encrypted = base64.b64encode(public_key.encrypt(
-            password,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        ))
+        encrypted = base64.b64encode(public_key.encrypt(password, oaep_padding()))
 
         return encrypted
 
     def decode_password(self, encrypted_password):
         private_key = self.load_private_key()
-        decrypted = private_key.decrypt(
-            base64.b64decode(encrypted_password),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
+        decrypted = private_key.decrypt(base64.b64decode(encrypted_password), oaep_padding())
         return decrypted.decode(encoding='utf-8')
 
     def set_service_password(self, service, password):
         encrypted_password = self.encode_password(password)
-        conn = sqlite3.connect(self.passwords_db)
         sql = 'INSERT OR REPLACE INTO passwords(service_name,service_password) VALUES(?,?)'
-        cur = conn.cursor()
-        cur.execute(sql, (service, encrypted_password))
-        conn.commit()
-        conn.close()
+        with self.cache.lock:
+            conn = self.cache.get_connection(self.passwords_db)
+            cur = conn.cursor()
+            cur.execute(sql, (service, encrypted_password))
+            conn.commit()
+            self.cache.invalidate()
 
         return cur.lastrowid
 
     def get_service_password(self, service):
-        conn = sqlite3.connect(self.passwords_db)
-        cur = conn.cursor()
-        cur.execute("SELECT service_password FROM passwords WHERE service_name=?", (service,))
-        row = cur.fetchone()
-        conn.close()
+        return self.cache.get_password(self.passwords_db, service, lambda: self.read_service_password(service))
+
+    def read_service_password(self, service):
+        with self.cache.lock:
+            cur = self.cache.get_connection(self.passwords_db).cursor()
+            cur.execute("SELECT service_password FROM passwords WHERE service_name=?", (service,))
+            row = cur.fetchone()
         return self.decode_password(row[0])
 
     @property
@@ -0,0 +1,239 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = 'CLOUDBLUE_CONNECTOR_PROFILE'
+CPROFILE_ENV = 'CLOUDBLUE_CONNECTOR_PROFILE_CPROFILE'
+
+LOG = logging.getLogger("profiling")
+
+
+class NullSpan(object):
+    """Context manager used in place of a span when profiling is disabled"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    __slots__ = ('name', 'started', 'duration', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.duration = None
+        self.children = []
+
+    def finish(self):
+        self.duration = time.time() - self.started
+
+    def self_time(self):
+        # children collected in parallel threads may take longer than their parent
+        return max(self.duration - sum(child.duration or 0 for child in self.children), 0)
+
+    def collapse(self, stacks, prefix=''):
+        """Add self time of the span and its children to flame graph stacks (in microseconds)"""
+        path = prefix + self.name.replace(';', ':').replace(' ', '_')
+        stacks[path] += int(self.self_time() * 1000000)
+        for child in self.children:
+            if child.duration is not None:
+                child.collapse(stacks, path + ';')
+
+    def format(self):
+        tree = '{} {:.1f}ms'.format(self.name, (self.duration or 0) * 1000)
+        if self.children:
+            tree += ' [{}]'.format(', '.join(child.format() for child in self.children))
+        return tree
+
+
+class Profiler(object):
+    """Collects span tree of each request and aggregates them per automation engine
+
+    Spans are recorded only inside request span started by context_log, so
+    listing and other work between requests is not profiled. With cprofile
+    enabled, each request is profiled by cProfile in its thread.
+    """
+
+    def __init__(self, output_dir, cprofile=False):
+        self.output_dir = output_dir
+        self.cprofile = cprofile
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # engine -> flame graph stack -> microseconds
+        self.stacks = collections.defaultdict(collections.Counter)
+        # engine -> pstats.Stats
+        self.stats = {}
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    @contextmanager
+    def request_span(self, engine, name, request_id):
+        stack = self.stack()
+        if stack:
+            # nested context_log call of the same request
+            with self.span(name):
+                yield
+            return
+
+        root = Span('{}.{}'.format(engine, name))
+        stack.append(root)
+        profile = None
+        if self.cprofile:
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            root.finish()
+            stack.pop()
+            self.add_request(engine, request_id, root, profile)
+
+    @contextmanager
+    def span(self, name):
+        stack = self.stack()
+        span = Span(name)
+        stack[-1].children.append(span)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span.finish()
+            stack.pop()
+
+    @contextmanager
+    def attached(self, parent):
+        """Make spans of the current thread children of parent span from another thread"""
+        stack = self.stack()
+        stack.append(parent)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def current_span(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    def add_request(self, engine, request_id, root, profile):
+        LOG.debug('%s: %s', request_id, root.format())
+        with self.lock:
+            root.collapse(self.stacks[engine])
+            if profile is not None:
+                if engine in self.stats:
+                    self.stats[engine].add(profile)
+                else:
+                    import pstats
+
+                    self.stats[engine] = pstats.Stats(profile)
+
+    def dump(self, engine):
+        """Write collected stacks and cProfile statistics of the engine, collected data is reset"""
+        with self.lock:
+            stacks = self.stacks.pop(engine, None)
+            stats = self.stats.pop(engine, None)
+        if not stacks:
+            return
+
+        filename = os.path.join(self.output_dir, '{}-{}'.format(engine, time.strftime('%Y%m%d-%H%M%S')))
+        with open(filename + '.folded', 'w') as f:
+            for path, value in sorted(stacks.items()):
+                f.write('{} {}\n'.format(path, value))
+        if stats is not None:
+            stats.dump_stats(filename + '.prof')
+        LOG.info('Profile of %s is written to %s', engine, filename)
+
+
+profiler = None
+original_call_handlers = logging.Logger.callHandlers
+
+
+def call_handlers(self, record):
+    with span('logging'):
+        original_call_handlers(self, record)
+
+
+def enable(output_dir, cprofile=False):
+    """Start profiling, time of logging handlers is recorded as 'logging' span"""
+    global profiler
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    profiler = Profiler(output_dir, cprofile)
+    logging.Logger.callHandlers = call_handlers
+
+
+def disable():
+    global profiler
+
+    profiler = None
+    logging.Logger.callHandlers = original_call_handlers
+
+
+def configure_profiling(misc):
+    """Enable profiling if CLOUDBLUE_CONNECTOR_PROFILE or profiling_dir is set"""
+
+    output_dir = os.environ.get(PROFILE_ENV) or misc.get('profiling_dir')
+    if not output_dir:
+        disable()
+        return
+    cprofile = os.environ.get(CPROFILE_ENV, '').lower() in ('1', 'true', 'yes') or misc.get('profiling_cprofile', False)
+    if profiler is None or profiler.output_dir != output_dir or profiler.cprofile != cprofile:
+        enable(output_dir, cprofile)
+
+
+def request_span(engine, name, request_id):
+    if profiler is None:
+        return NULL_SPAN
+    return profiler.request_span(engine, name, request_id)
+
+
+def span(name, labels=None):
+    """Record span inside of the current request span, do nothing outside of requests or if profiling is disabled"""
+    if profiler is None or not profiler.current_span():
+        return NULL_SPAN
+    if labels:
+        name = '{}:{}'.format(name, ','.join(str(value) for value in labels.values()))
+    return profiler.span(name)
+
+
+def current_span():
+    if profiler is None:
+        return None
+    return profiler.current_span()
+
+
+def attached(parent):
+    if profiler is None or parent is None:
+        return NULL_SPAN
+    return profiler.attached(parent)
+
+
+def dump(engine):
+    if profiler is not None:
+        try:
+            profiler.dump(engine)
+        except Exception:
+            LOG.exception('Profile of %s is not written', engine)
@@ -0,0 +1,89 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class AdaptiveRateLimiter(object):
+    """Token bucket shared by all threads, its rate is adapted with AIMD
+
+    Rate grows by increase (requests per second) after each successful call up
+    to max_rate and is multiplied by decrease when server throttles calls. No
+    call is made until Retry-After time passes. When max_rate is not set,
+    calls are not limited, only Retry-After pauses are respected.
+    """
+
+    def __init__(self, max_rate=None, burst=None, min_rate=1.0, increase=0.1, decrease=0.5):
+        self.max_rate = max_rate or None
+        self.min_rate = min(min_rate, self.max_rate) if self.max_rate else min_rate
+        self.rate = self.max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.capacity = burst or max(self.max_rate or 1, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until call is allowed"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        if self.rate is None:
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            if self.rate is not None:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.tokens = 0
+                self.updated = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+                # tokens are not accumulated while calls are paused
+                self.updated = max(self.updated, self.paused_until)
+
+
+def retry_after(response):
+    """Return delay (in seconds) requested by Retry-After header of the response"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, backoff, max_backoff):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
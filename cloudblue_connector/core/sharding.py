@@ -0,0 +1,159 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+
+LOG = logging.getLogger("sharding")
+
+
+def shard_of(key, count):
+    """Stable shard of the key, the same on all nodes and Python versions"""
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+class StaticShard(object):
+    """Fixed partition of Assets set by shard_index and shard_count of each node"""
+
+    def __init__(self, index, count):
+        if not 0 <= index < count:
+            raise ValueError('shard_index {} is out of range of shard_count {}'.format(index, count))
+        self.index = index
+        self.count = count
+
+    def refresh(self):
+        pass
+
+    def owns(self, key):
+        return shard_of(key, self.count) == self.index
+
+    def claim(self, key, report_name):
+        return self.owns(key)
+
+    def confirm(self, report_name):
+        pass
+
+    def release(self, report_name):
+        pass
+
+
+class LeaseShard(object):
+    """Partition of Assets between live nodes registered in shared database
+
+    Each node updates its heartbeat and takes hash partition of Assets by its
+    position among nodes with fresh heartbeat. When a node stops, its
+    heartbeat expires and its Assets are taken by other nodes. Before usage
+    file is created, ownership is checked again with fresh list of nodes and
+    report name is claimed in the database, so the report of a period is not
+    created by two nodes when nodes join or leave during a run. The claim is
+    confirmed when the report is submitted. It is released if the report is
+    not submitted, and claims not confirmed in heartbeat_ttl (e.g. of a node
+    which failed) expire, so the report can be created by another node.
+    """
+
+    claims_ttl = 7 * 24 * 3600
+
+    def __init__(self, store, node_id=None, heartbeat_ttl=300):
+        self.store = store
+        self.node_id = node_id or socket.gethostname()
+        self.heartbeat_ttl = heartbeat_ttl
+        self.lock = threading.Lock()
+        self.conn = None
+        self.index = 0
+        self.count = 1
+        self.refreshed_at = 0
+
+    def connect(self):
+        if self.conn is None:
+            store_dir = os.path.dirname(self.store)
+            if store_dir and not os.path.exists(store_dir):
+                os.makedirs(store_dir, 0o700)
+            self.conn = sqlite3.connect(self.store, timeout=30, check_same_thread=False)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS nodes (
+                                    node_id TEXT PRIMARY KEY,
+                                    heartbeat_at REAL NOT NULL
+                                    );""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS claims (
+                                    report_name TEXT PRIMARY KEY,
+                                    node_id TEXT NOT NULL,
+                                    claimed_at REAL NOT NULL
+                                    );""")
+            try:
+                self.conn.execute('ALTER TABLE claims ADD COLUMN confirmed INTEGER NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                # column is created by another node or previous version
+                pass
+            self.conn.commit()
+        return self.conn
+
+    def refresh(self):
+        """Update heartbeat of this node and take partition among live nodes"""
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO nodes(node_id, heartbeat_at) VALUES(?, ?)', (self.node_id, now))
+            conn.execute('DELETE FROM nodes WHERE heartbeat_at < ?', (now - self.heartbeat_ttl,))
+            conn.execute('DELETE FROM claims WHERE claimed_at < ?', (now - self.claims_ttl,))
+            conn.execute('DELETE FROM claims WHERE confirmed = 0 AND claimed_at < ?', (now - self.heartbeat_ttl,))
+            conn.commit()
+            nodes = [row[0] for row in conn.execute('SELECT node_id FROM nodes ORDER BY node_id')]
+            index, count = nodes.index(self.node_id), len(nodes)
+            if (index, count) != (self.index, self.count):
+                LOG.info('Node %s takes shard %s of %s', self.node_id, index, count)
+            self.index, self.count = index, count
+            self.refreshed_at = now
+
+    def owns(self, key):
+        return shard_of(key, self.count) == self.index
+
+    def claim(self, key, report_name):
+        """Check ownership with fresh list of nodes and claim report, return True if report is claimed by this node"""
+        if time.time() - self.refreshed_at > self.heartbeat_ttl / 3.0:
+            self.refresh()
+        if not self.owns(key):
+            return False
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR IGNORE INTO claims(report_name, node_id, claimed_at) VALUES(?, ?, ?)',
+                         (report_name, self.node_id, time.time()))
+            conn.commit()
+            row = conn.execute('SELECT node_id FROM claims WHERE report_name=?', (report_name,)).fetchone()
+        return row is not None and row[0] == self.node_id
+
+    def confirm(self, report_name):
+        """Keep claim of submitted report for claims_ttl"""
+        with self.lock:
+            conn = self.connect()
+            conn.execute('UPDATE claims SET confirmed = 1 WHERE report_name=? AND node_id=?',
+                         (report_name, self.node_id))
+            conn.commit()
+
+    def release(self, report_name):
+        """Remove claim of report which is not submitted, so it can be claimed again"""
+        with self.lock:
+            conn = self.connect()
+            conn.execute('DELETE FROM claims WHERE report_name=? AND node_id=?', (report_name, self.node_id))
+            conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def create_shard(misc):
+    """Return shard of this node configured by misc options or None if sharding is not enabled"""
+    if misc.get('shard_store'):
+        return LeaseShard(misc['shard_store'], misc.get('shard_node_id'), misc.get('shard_heartbeat_ttl', 300))
+    if misc.get('shard_count', 1) > 1:
+        return StaticShard(misc.get('shard_index', 0), misc['shard_count'])
+    return None
@@ -0,0 +1,130 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from cloudblue_connector.core import connect_session, metrics, profiling
+
+
+class RunSummary(object):
+    """Compact summary of requests processed in one run
+
+    Keeps counters per request status and outcome, processing time per
+    outcome and ids of the most recent requests only, so memory does not
+    grow with the number of processed requests.
+    """
+
+    def __init__(self, name, recent_size=100):
+        self.name = name
+        self.lock = threading.Lock()
+        self.recent = collections.deque(maxlen=recent_size)
+        self.start()
+
+    def start(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.finished_at = None
+            self.counters = collections.Counter()
+            # outcome -> [count, total seconds, max seconds]
+            self.timings = {}
+            self.recent.clear()
+            # Connect connections opened and requests sent during the run
+            self.connections = None
+            self.connections_at_start = connect_session.connection_stats()
+
+    def finish(self):
+        self.finished_at = time.time()
+        connections, sent = connect_session.connection_stats()
+        self.connections = (max(connections - self.connections_at_start[0], 0),
+                            max(sent - self.connections_at_start[1], 0))
+        metrics.RUN_DURATION.set(self.duration, engine=self.name)
+        metrics.RUN_FINISHED.set(self.finished_at, engine=self.name)
+        profiling.dump(self.name)
+        return self
+
+    def add(self, request_id, status, outcome, duration):
+        with self.lock:
+            self.counters[(status, outcome)] += 1
+            timing = self.timings.setdefault(outcome, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += duration
+            timing[2] = max(timing[2], duration)
+            self.recent.append(request_id)
+        metrics.REQUESTS.inc(engine=self.name, status=status, outcome=outcome)
+        metrics.REQUEST_DURATION.observe(duration, engine=self.name, outcome=outcome)
+
+    @contextmanager
+    def track(self, request):
+        """Record duration and outcome of request processing
+
+        Outcome is the value stored to outcome[0], the code of raised Connect
+        exception or the name of other raised exception.
+        """
+        started = time.time()
+        outcome = ['done']
+        try:
+            yield outcome
+        except Exception as e:
+            outcome[0] = getattr(e, 'code', None) or e.__class__.__name__
+            raise
+        finally:
+            self.add(request.id, getattr(request, 'status', None), outcome[0], time.time() - started)
+
+    @property
+    def duration(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def processed(self):
+        return sum(self.counters.values())
+
+    def throughput(self):
+        """Number of processed requests per second for each status"""
+        duration = max(self.duration, 0.001)
+        statuses = collections.Counter()
+        for (status, _), count in self.counters.items():
+            statuses[status] += count
+        return {status: round(count / duration, 3) for status, count in statuses.items()}
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'started_at': self.started_at,
+                'duration': round(self.duration, 3),
+                'processed': self.processed,
+                'counters': [
+                    {'status': status, 'outcome': outcome, 'count': count}
+                    for (status, outcome), count in sorted(self.counters.items(), key=str)
+                ],
+                'timings': {
+                    outcome: {'count': count, 'total': round(total, 3), 'max': round(longest, 3)}
+                    for outcome, (count, total, longest) in self.timings.items()
+                },
+                'throughput': self.throughput(),
+                'connections': {'opened': self.connections[0], 'requests': self.connections[1]}
+                if self.connections else None,
+                'recent': list(self.recent),
+            }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def __str__(self):
+        with self.lock:
+            counters = ', '.join('{}/{}: {}'.format(status, outcome, count)
+                                 for (status, outcome), count in sorted(self.counters.items(), key=str))
+        summary = '{}: {} requests processed in {:.3f} seconds, {:.2f} per second ({})'.format(
+            self.name, self.processed, self.duration, self.processed / max(self.duration, 0.001),
+            counters or 'nothing to process')
+        if self.connections:
+            summary += ', {} Connect requests sent over {} connections'.format(self.connections[1],
+                                                                              self.connections[0])
+        return summary
@@ -0,0 +1,62 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class UsageReportState(object):
+    """Local store of the last usage report created for each subscription"""
+
+    state_db = '/var/lib/cloudblue-connector/usage_state.sqlite3'
+    time_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, state_db=None):
+        self.state_db = state_db or self.state_db
+        state_dir = os.path.dirname(self.state_db)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir, 0o700)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.state_db, check_same_thread=False)
+        self.create_database()
+
+    def create_database(self):
+        sql = """CREATE TABLE IF NOT EXISTS usage_reports (
+                    subscription_id TEXT PRIMARY KEY,
+                    report_name TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                    );"""
+        with self.lock:
+            self.conn.execute(sql)
+            self.conn.commit()
+
+    def get_last_report(self, subscription_id):
+        """Return (report name, end of reported period, status) or None"""
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT report_name, period_end, status FROM usage_reports WHERE subscription_id=?",
+                (subscription_id,))
+            row = cur.fetchone()
+        if not row:
+            return None
+        return row[0], datetime.strptime(row[1], self.time_format), row[2]
+
+    def set_last_report(self, subscription_id, report_name, period_end, status):
+        sql = 'INSERT OR REPLACE INTO usage_reports(subscription_id,report_name,period_end,status,updated_at) ' \
+              'VALUES(?,?,?,?,?)'
+        with self.lock:
+            self.conn.execute(sql, (subscription_id, report_name, period_end.strftime(self.time_format), status,
+                                    datetime.utcnow().strftime(self.time_format)))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
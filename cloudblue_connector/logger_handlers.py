@@ -1,23 +1,147 @@
 import logging.handlers
 import zipfile
 import codecs
+import fcntl
 import os
 import time
 import glob
+import bz2
+import gzip
+import lzma
+import shutil
+import threading
+import queue
+from contextlib import contextmanager
+
+# queued to compress thread to compress files left by previous processes
+RECOVER = "recover"
+
+
+def open_zip(filename, compresslevel):
+    # compresslevel of ZipFile is supported since Python 3.7
+    kwargs = {"compresslevel": compresslevel} if compresslevel is not None else {}
+    archive = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED, **kwargs)
+    member = archive.open(os.path.basename(filename)[:-len(".zip.tmp")], "w", force_zip64=True)
+
+    # close archive together with its member
+    close_member = member.close
+
+    def close():
+        close_member()
+        archive.close()
+    member.close = close
+    return member
 
 
 class TimedCompressedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
     """
     Extended version of TimedRotatingFileHandler that compress logs on rollover.
+
+    Rotated file is compressed by background thread, so logging threads are
+    not blocked while a large file is compressed. Files rotated but not
+    compressed because of process crash are compressed at startup.
+
+    Services may log to the same file, so rotated files are compressed under
+    exclusive lock of <filename>.lock shared by all processes.
     """
 
+    # compression -> (file extension, function to open compressed file for writing)
+    compressors = {
+        "zip": (".zip", open_zip),
+        "gzip": (".gz", lambda filename, level: gzip.open(filename, "wb", level or 9)),
+        "bz2": (".bz2", lambda filename, level: bz2.open(filename, "wb", level or 9)),
+        "xz": (".xz", lambda filename, level: lzma.open(filename, "wb", preset=level)),
+    }
+    chunk_size = 1024 * 1024
+
+    def __init__(self, filename, when='h', interval=1, backupCount=0, encoding=None, delay=False, utc=False,
+                 atTime=None, compression="zip", compresslevel=None):
+        super(TimedCompressedRotatingFileHandler, self).__init__(
+            filename, when, interval, backupCount, encoding, delay, utc, atTime)
+        if compression not in self.compressors:
+            raise ValueError("Unknown compression '{}'".format(compression))
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.extension = self.compressors[compression][0]
+        self.compress_queue = queue.Queue()
+        self.compress_thread = threading.Thread(target=self.compress_worker, name="log-compressor")
+        self.compress_thread.daemon = True
+        self.compress_thread.start()
+        self.compress_queue.put(RECOVER)
+
+    @contextmanager
+    def compress_lock(self):
+        """Exclusive lock of rotated files shared by all processes logging to the same file"""
+        with open(self.baseFilename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def recover(self):
+        """Compress files which were rotated but not compressed"""
+        extensions = tuple(ext for ext, _ in self.compressors.values())
+        with self.compress_lock():
+            # temporary files are not written by other processes while the lock is held
+            for tmp in glob.glob(self.baseFilename + ".20*.tmp"):
+                os.remove(tmp)
+            for dfn in sorted(glob.glob(self.baseFilename + ".20*")):
+                if not dfn.endswith(extensions):
+                    self.compress_locked(dfn)
+
+    def compress_worker(self):
+        while True:
+            dfn = self.compress_queue.get()
+            try:
+                if dfn is False:
+                    return
+                if dfn is RECOVER:
+                    self.recover()
+                else:
+                    self.compress(dfn)
+                with self.compress_lock():
+                    self.remove_old_files()
+            except Exception:
+                self.handleError(logging.makeLogRecord({"msg": "Cannot compress {}".format(dfn)}))
+            finally:
+                self.compress_queue.task_done()
+
+    def compress(self, dfn):
+        with self.compress_lock():
+            self.compress_locked(dfn)
+
+    def compress_locked(self, dfn):
+        if not os.path.exists(dfn):
+            # compressed by another process
+            return
+        tmp = dfn + self.extension + ".tmp"
+        with open(dfn, "rb") as source:
+            target = self.compressors[self.compression][1](tmp, self.compresslevel)
+            try:
+                shutil.copyfileobj(source, target, self.chunk_size)
+            finally:
+                target.close()
+        os.rename(tmp, dfn + self.extension)
+        os.remove(dfn)
+
+    def remove_old_files(self):
+        if self.backupCount > 0:
+            # find the oldest compressed log files and delete them,
+            # files compressed before compression was changed are counted too
+            s = [dfn for ext, _ in self.compressors.values() for dfn in glob.glob(self.baseFilename + ".20*" + ext)]
+            if len(s) > self.backupCount:
+                s.sort()
+                for dfn in s[:len(s) - self.backupCount]:
+                    os.remove(dfn)
+
     def doRollover(self):
         """
         do a rollover; in this case, a date/time stamp is appended to the filename
         when the rollover happens.  However, you want the file to be named for the
-        start of the interval, not the current time.  If there is a backup count,
-        then we have to get a list of matching filenames, sort them and remove
-        the one with the oldest suffix.
+        start of the interval, not the current time.  Rotated file is passed to
+        background thread which compresses it and removes the oldest compressed
+        files if there is a backup count.
         """
 
         self.stream.close()
@@ -28,20 +152,19 @@ class TimedCompressedRotatingFileHandler(logging.handlers.TimedRotatingFileHandl
         if os.path.exists(dfn):
             os.remove(dfn)
         os.rename(self.baseFilename, dfn)
-        if self.backupCount > 0:
-            # find the oldest log file and delete it
-            s = glob.glob(self.baseFilename + ".20*")
-            if len(s) > self.backupCount:
-                s.sort()
-                os.remove(s[0])
         if self.encoding:
             self.stream = codecs.open(self.baseFilename, 'w', self.encoding)
         else:
             self.stream = open(self.baseFilename, 'w')
         self.rolloverAt = self.rolloverAt + self.interval
-        if os.path.exists(dfn + ".zip"):
-            os.remove(dfn + ".zip")
-        file = zipfile.ZipFile(dfn + ".zip", "w")
-        file.write(dfn, os.path.basename(dfn), zipfile.ZIP_DEFLATED)
-        file.close()
-        os.remove(dfn)
+        if os.path.exists(dfn + self.extension):
+            os.remove(dfn + self.extension)
+        self.compress_queue.put(dfn)
+
+    def close(self):
+        """Wait until rotated files are compressed and close the file"""
+        compress_thread = getattr(self, "compress_thread", None)
+        if compress_thread is not None and compress_thread.is_alive():
+            self.compress_queue.put(False)
+            compress_thread.join()
+        super(TimedCompressedRotatingFileHandler, self).close()
@@ -3,51 +3,310 @@
 # This source code is distributed under MIT software license.
 # ******************************************************************************
 # -*- coding: utf-8 -*-
+import signal
+import threading
+import time
 import warnings
 
-from cloudblue_connector.automation import FulfillmentAutomation, UsageAutomation, UsageFileAutomation
-from cloudblue_connector_backend.connector import ConnectorConfig
-from connect.rql import Query
+from cloudblue_connector.core import ConnectorPasswords, getLogger, metrics, profiling
+from cloudblue_connector.core.logger import config_context, init_logging, use_context_config
 
-from cloudblue_connector.core import ConnectorPasswords
+# Automation engines, Connect SDK and backend are imported by functions which
+# use them, so each entry point imports only what it needs
 
 # Enable processing of deprecation warnings
 warnings.simplefilter('default')
 
+CONFIG_FILE = '/etc/cloudblue-connector/config.json'
+
 
 def process_fulfillment():
     """Process all new Fulfillments"""
-    ConnectorConfig(file='/etc/cloudblue-connector/config.json', report_usage=False)
-    mngr = FulfillmentAutomation()
-    if not mngr.is_backend_alive():
+    init_logging()
+    from cloudblue_connector.automation.fulfillment import FulfillmentAutomation
+    from cloudblue_connector_backend.connector import ConnectorConfig
+
+    configure_run(ConnectorConfig(file=CONFIG_FILE, report_usage=False).misc)
+    try:
+        return run_fulfillment(FulfillmentAutomation())
+    finally:
+        export_metrics('fulfillments')
+
+
+def configure_run(misc):
+    """Set up shared Connect session, backend circuit breaker and profiling from misc options"""
+    from cloudblue_connector.core import breaker, connect_session
+
+    connect_session.install(misc)
+    breaker.install(misc)
+    profiling.configure_profiling(misc)
+
+
+def is_backend_alive(mngr):
+    """Check backend and record result and duration of the check in metrics
+
+    Backend is not checked while circuit breaker of backend calls is open,
+    the check made when it is half-open is the probe which closes it.
+    """
+    from cloudblue_connector.core import breaker
+
+    engine = mngr.summary.name
+    backend = breaker.backend
+    backend.refresh()
+    if not backend.allow():
+        getLogger(engine).warning('Backend circuit breaker is open, run is skipped')
+        metrics.BACKEND_ALIVE.set(0, engine=engine)
+        return False
+    started = time.time()
+    try:
+        with metrics.BACKEND_CHECK_DURATION.time(engine=engine):
+            alive = mngr.is_backend_alive()
+    except Exception:
+        backend.record(True, time.time() - started)
+        raise
+    backend.record(not alive, time.time() - started)
+    metrics.BACKEND_ALIVE.set(1 if alive else 0, engine=engine)
+    return alive
+
+
+def metrics_textfile(path, service):
+    """Return textfile of the service, e.g. <dir>/cloudblue_connector.usage.prom for <dir>/cloudblue_connector.prom
+
+    Each service writes only metrics of its own process, so services do not
+    replace series of each other.
+    """
+    base = path[:-len('.prom')] if path.endswith('.prom') else path
+    return '{}.{}.prom'.format(base, service)
+
+
+def export_metrics(service, misc=None):
+    """Write metrics to textfile collector file of the service if it is configured"""
+    from connect.config import Config
+
+    misc = misc if misc is not None else Config.get_instance().misc
+    path = misc.get('metrics_textfile')
+    if path:
+        path = metrics_textfile(path, service)
+        try:
+            metrics.write_textfile(path)
+        except Exception:
+            getLogger('metrics').exception('Metrics are not written to %s', path)
+
+
+def listing_filters(filters, config, prefix=''):
+    """Add products and testMode/testMarketplaceId rules to listing query
+
+    Requests and Assets of other products and Marketplaces are excluded by
+    CloudBlue Connect, so they are not transferred and parsed just to be
+    skipped. Prefix is the path of Asset in listed objects, e.g. 'asset.'.
+    """
+    if config.products:
+        filters.in_(prefix + 'product.id', config.products)
+    marketplace_id = config.misc.get('testMarketplaceId')
+    if marketplace_id:
+        if config.misc.get('testMode', False):
+            filters.equal(prefix + 'marketplace.id', marketplace_id)
+        else:
+            filters.not_equal(prefix + 'marketplace.id', marketplace_id)
+    return filters
+
+
+def run_fulfillment(mngr):
+    mngr.summary.start()
+    if not is_backend_alive(mngr):
         return
-    mngr.process()
-    return mngr.fulfillments
+    mngr.process(listing_filters(mngr.filters(), mngr.config, 'asset.'))
+    return mngr.summary.finish()
 
 
 def process_usage():
     """Confirm all created UsageFiles"""
+    init_logging()
+    from cloudblue_connector.automation.usage import UsageAutomation
+    from cloudblue_connector_backend.connector import ConnectorConfig
+
+    configure_run(ConnectorConfig(file=CONFIG_FILE, report_usage=True).misc)
+    try:
+        return run_usage(UsageAutomation())
+    finally:
+        export_metrics('usage')
+
+
+def run_usage(mngr):
+    from connect.rql import Query
 
-    ConnectorConfig(file='/etc/cloudblue-connector/config.json', report_usage=True)
-    mngr = UsageAutomation()
-    if not mngr.is_backend_alive():
+    mngr.summary.start()
+    if not is_backend_alive(mngr):
         return
     if mngr.is_report_suspended_needed():
         filters = Query().in_('status', ['active', 'suspended'])
     else:
         filters = Query().in_('status', ['active'])
+    listing_filters(filters, mngr.config)
     mngr.process(filters)
-    return mngr.usages
+    return mngr.summary.finish()
+
 
 def process_usage_files():
     """Confirm all created UsageFiles"""
+    init_logging()
+    from cloudblue_connector.automation.usage_file import UsageFileAutomation
+    from cloudblue_connector_backend.connector import ConnectorConfig
+
+    configure_run(ConnectorConfig(file=CONFIG_FILE, report_usage=True).misc)
+    try:
+        return run_usage_files(UsageFileAutomation())
+    finally:
+        export_metrics('usage_files')
+
 
-    ConnectorConfig(file='/etc/cloudblue-connector/config.json', report_usage=True)
-    mngr = UsageFileAutomation()
-    if not mngr.is_backend_alive():
+def run_usage_files(mngr):
+    mngr.summary.start()
+    if not is_backend_alive(mngr):
         return
     mngr.process()
-    return mngr.files
+    return mngr.summary.finish()
+
+
+class ConnectorDaemon(object):
+    """Runs Fulfillments, usage and UsageFiles processing in one long-running process
+
+    Configuration and automation engines are created once and reused by all
+    cycles. Each kind of processing runs in its own thread and waits for its
+    own interval between cycles. Configuration is reloaded when no cycle is
+    running, cycles are not started until the reload is finished.
+    """
+
+    # name, runner and misc option with interval (in seconds) between cycles
+    loops = (
+        ('fulfillments', run_fulfillment, 'daemon_fulfillments_interval'),
+        ('usage', run_usage, 'daemon_usage_interval'),
+        ('usage_files', run_usage_files, 'daemon_usage_files_interval'),
+    )
+    default_interval = 30
+
+    def __init__(self):
+        self.logger = getLogger('ConnectorDaemon')
+        self.stop_event = threading.Event()
+        self.reload_event = threading.Event()
+        # cycles run concurrently, reload waits for running cycles and blocks new ones
+        self.cycles = threading.Condition()
+        self.running_cycles = 0
+        self.reloading = False
+        self.engines = {}
+        self.misc = {}
+        # name -> (started at, duration of the last cycle, number of cycles)
+        self.cycle_timings = {}
+        self.load_config()
+        self.metrics_server = None
+        port = self.misc.get('metrics_port')
+        if port:
+            self.metrics_server = metrics.start_http_server(port, self.misc.get('metrics_address', '127.0.0.1'))
+
+    def load_config(self):
+        """Read configuration and create automation engines
+
+        Each engine gets its own configuration. Config.get_instance() returns
+        configuration of the engine running in the current thread, so Connect
+        SDK and backend take products and options of the engine too.
+        """
+        init_logging(reload=True)
+        from cloudblue_connector.automation import FulfillmentAutomation, UsageAutomation, UsageFileAutomation
+        from cloudblue_connector_backend.connector import ConnectorConfig
+
+        use_context_config()
+
+        fulfillment_config = ConnectorConfig(file=CONFIG_FILE, report_usage=False)
+        usage_config = ConnectorConfig(file=CONFIG_FILE, report_usage=True)
+        configure_run(usage_config.misc)
+        engines = {
+            'fulfillments': FulfillmentAutomation(fulfillment_config),
+            'usage': UsageAutomation(usage_config),
+            'usage_files': UsageFileAutomation(usage_config),
+        }
+        for engine in engines.values():
+            engine.stop_event = self.stop_event
+        self.engines = engines
+        self.misc = fulfillment_config.misc
+
+    def reload_config(self):
+        """Wait for running cycles and load configuration, cycles are not started meanwhile"""
+        with self.cycles:
+            self.reloading = True
+            while self.running_cycles:
+                self.cycles.wait()
+        try:
+            self.load_config()
+        finally:
+            with self.cycles:
+                self.reloading = False
+                self.cycles.notify_all()
+
+    def run_cycle(self, name, runner):
+        with self.cycles:
+            while self.reloading:
+                self.cycles.wait()
+            self.running_cycles += 1
+            engine = self.engines[name]
+        try:
+            started = time.time()
+            try:
+                with config_context(engine.config):
+                    summary = runner(engine)
+            except Exception:
+                summary = None
+                self.logger.exception('%s cycle failed', name)
+            duration = time.time() - started
+            cycles = self.cycle_timings.get(name, (0, 0, 0))[2] + 1
+            self.cycle_timings[name] = (started, duration, cycles)
+            self.logger.info('%s cycle #%s finished in %.3f seconds: %s', name, cycles, duration, summary)
+            export_metrics('daemon', engine.config.misc)
+        finally:
+            with self.cycles:
+                self.running_cycles -= 1
+                self.cycles.notify_all()
+
+    def run_loop(self, name, runner, interval_option):
+        while not self.stop_event.is_set():
+            self.run_cycle(name, runner)
+            self.stop_event.wait(self.misc.get(interval_option, self.default_interval))
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.run_loop, args=loop, name=loop[0])
+            for loop in self.loops
+        ]
+        for thread in threads:
+            thread.start()
+
+        while not self.stop_event.is_set():
+            if self.reload_event.wait(1):
+                self.reload_event.clear()
+                self.logger.info('Reloading configuration')
+                try:
+                    self.reload_config()
+                except Exception:
+                    self.logger.exception('Configuration is not reloaded')
+
+        self.logger.info('Stopping, waiting for running cycles to finish')
+        for thread in threads:
+            thread.join()
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def reload(self, *args):
+        self.reload_event.set()
+
+
+def run_daemon():
+    """Process Fulfillments, usage and UsageFiles until SIGTERM is received, SIGHUP reloads configuration"""
+
+    daemon = ConnectorDaemon()
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGHUP, daemon.reload)
+    daemon.run()
 
 
 def set_cloudblue_token(token):
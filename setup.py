@@ -21,6 +21,6 @@ setup(
         'cloudblue_connector.automation',
         'cloudblue_connector.core',
     ],
-    scripts=['cloudblue-fulfillments', 'cloudblue-usage', 'cloudblue-usage-files'],
+    scripts=['cloudblue-fulfillments', 'cloudblue-usage', 'cloudblue-usage-files', 'cloudblue-connector-daemon'],
     long_description=open('README.txt').read(),
 )
\ No newline at end of file
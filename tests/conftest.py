@@ -0,0 +1,15 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+try:
+    import cloudblue_connector_backend  # noqa: F401
+except ImportError:
+    # tests of automation engines use fake backend of benchmarks if backend package is not installed
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    'benchmarks', 'fake_backend'))
@@ -0,0 +1,116 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+
+import pytest
+
+from cloudblue_connector.core import breaker
+from cloudblue_connector.core.breaker import (
+    CLOSED, HALF_OPEN, OPEN, BackendUnavailable, BreakerState, CircuitBreaker, is_failure)
+
+
+class ServerError(Exception):
+
+    def __init__(self, status_code):
+        super(ServerError, self).__init__(status_code)
+        self.status_code = status_code
+
+
+class ConnectException(Exception):
+    code = 'skip'
+
+
+def fail(e):
+    def func():
+        raise e
+    return func
+
+
+@pytest.mark.parametrize('error, failed', [
+    (ConnectionRefusedError(), True),
+    (TimeoutError(), True),
+    (socket.timeout(), True),
+    (ServerError(503), True),
+    (ServerError(404), False),
+    (KeyError('project_id'), False),
+    (ValueError(), False),
+    (ConnectException(), False),
+])
+def test_only_transport_and_server_errors_are_failures(error, failed):
+    assert is_failure(error) is failed
+
+
+def test_request_errors_do_not_open_circuit():
+    cb = CircuitBreaker('test', window=10, min_calls=2, failure_rate=0.5)
+    for _ in range(10):
+        with pytest.raises(KeyError):
+            cb.call(fail(KeyError('project_id')))
+    assert cb.state == CLOSED
+
+
+def test_circuit_opens_on_failure_rate_and_rejects_calls():
+    cb = CircuitBreaker('test', window=4, min_calls=4, failure_rate=0.5, open_time=60)
+    cb.call(lambda: None)
+    cb.call(lambda: None)
+    with pytest.raises(ConnectionError):
+        cb.call(fail(ConnectionError()))
+    assert cb.state == CLOSED
+    with pytest.raises(ConnectionError):
+        cb.call(fail(ConnectionError()))
+    assert cb.state == OPEN
+    assert cb.is_open()
+    with pytest.raises(BackendUnavailable):
+        cb.call(lambda: None)
+
+
+def test_slow_calls_are_failures():
+    cb = CircuitBreaker('test', window=2, min_calls=2, failure_rate=1, slow_call=0.01)
+    cb.call(time.sleep, 0.02)
+    cb.call(time.sleep, 0.02)
+    assert cb.state == OPEN
+
+
+def test_half_open_allows_one_probe():
+    cb = CircuitBreaker('test', min_calls=1, failure_rate=1, open_time=0.05)
+    with pytest.raises(TimeoutError):
+        cb.call(fail(TimeoutError()))
+    assert not cb.allow()
+    time.sleep(0.06)
+    assert cb.allow()
+    assert cb.state == HALF_OPEN
+    assert not cb.allow()
+    assert cb.is_open()
+
+    cb.record(True, 0)
+    assert cb.state == OPEN
+    time.sleep(0.06)
+    cb.call(lambda: None)
+    assert cb.state == CLOSED
+    assert cb.allow()
+
+
+def test_open_state_is_shared_through_store(tmp_path):
+    state_db = str(tmp_path / 'state' / 'breaker.sqlite3')
+    first = CircuitBreaker('backend', min_calls=1, failure_rate=1, open_time=60, store=BreakerState(state_db))
+    with pytest.raises(ConnectionError):
+        first.call(fail(ConnectionError()))
+
+    second = CircuitBreaker('backend', store=BreakerState(state_db))
+    assert second.state == OPEN
+    assert second.opened_at == first.opened_at
+    assert not second.allow()
+
+
+def test_install_falls_back_to_memory_when_store_cannot_be_opened(tmp_path):
+    # state directory cannot be created under a file
+    (tmp_path / 'file').write_text('')
+    backend = breaker.install({'backend_breaker_state_db': str(tmp_path / 'file' / 'breaker.sqlite3'),
+                               'backend_breaker_min_calls': 3})
+    assert backend.store is None
+    assert backend.min_calls == 3
+    assert breaker.install({'backend_breaker_state_db': ''}).store is None
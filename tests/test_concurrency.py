@@ -0,0 +1,175 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from cloudblue_connector.core.concurrency import (
+    NoLimit, call_with_timeout, limiter, run_in_pool, run_ordered, run_ordered_in_pool, run_sequentially)
+
+# (key, id) of items, items of the same key must be processed in this order
+ITEMS = [('AS-1', 'PR-1'), ('AS-2', 'PR-2'), ('AS-1', 'PR-3'), ('AS-2', 'PR-4'), ('AS-1', 'PR-5')]
+
+
+def key_of(item):
+    return item[0]
+
+
+class Recorder(object):
+    """func of runners which records processed items and fails or rejects some of them"""
+
+    def __init__(self, failing=(), rejected=(), delay=0):
+        self.failing = failing
+        self.rejected = rejected
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.processed = []
+
+    def __call__(self, item):
+        with self.lock:
+            self.processed.append(item[1])
+        if self.delay:
+            time.sleep(self.delay)
+        if item[1] in self.failing:
+            raise ValueError(item[1])
+        return item[1] not in self.rejected
+
+
+def test_run_ordered_skips_group_after_failure():
+    func = Recorder(failing=('PR-1',))
+    assert run_ordered(func, ITEMS, key_of) == 1
+    assert func.processed == ['PR-1', 'PR-2', 'PR-4']
+
+
+def test_run_ordered_skips_group_after_rejected_item():
+    func = Recorder(rejected=('PR-2',))
+    assert run_ordered(func, ITEMS, key_of) == 1
+    assert func.processed == ['PR-1', 'PR-2', 'PR-3', 'PR-5']
+
+
+def test_run_ordered_stops_when_stop_event_is_set():
+    stop_event = threading.Event()
+    processed = []
+
+    def func(item):
+        processed.append(item[1])
+        stop_event.set()
+
+    assert run_ordered(func, ITEMS, key_of, stop_event) == 0
+    assert processed == ['PR-1']
+
+
+def test_run_ordered_in_pool_keeps_order_of_group():
+    func = Recorder(delay=0.01)
+    assert run_ordered_in_pool(func, ITEMS, key_of, workers=2) == 0
+    assert [i for i in func.processed if i in ('PR-1', 'PR-3', 'PR-5')] == ['PR-1', 'PR-3', 'PR-5']
+    assert [i for i in func.processed if i in ('PR-2', 'PR-4')] == ['PR-2', 'PR-4']
+
+
+def test_run_ordered_in_pool_skips_group_after_failure():
+    func = Recorder(failing=('PR-1',))
+    assert run_ordered_in_pool(func, ITEMS, key_of, workers=2) == 1
+    assert sorted(func.processed) == ['PR-1', 'PR-2', 'PR-4']
+
+
+def test_run_ordered_in_pool_skips_group_after_rejected_item():
+    func = Recorder(rejected=('PR-3',))
+    assert run_ordered_in_pool(func, ITEMS, key_of, workers=2) == 1
+    assert sorted(func.processed) == ['PR-1', 'PR-2', 'PR-3', 'PR-4']
+
+
+def test_run_ordered_in_pool_skips_group_after_timeout_and_waits_for_item():
+    finished = []
+
+    def func(item):
+        if item[1] == 'PR-1':
+            time.sleep(0.3)
+        finished.append(item[1])
+
+    assert run_ordered_in_pool(func, ITEMS, key_of, workers=2, timeout=0.05) == 1
+    # timed out item is finished before return, following items of its key are not processed
+    assert sorted(finished) == ['PR-1', 'PR-2', 'PR-4']
+
+
+def test_call_with_timeout_returns_result():
+    assert call_with_timeout(lambda item: item * 2, 2, 1, 'test') == (True, 4)
+
+    outstanding = []
+    assert call_with_timeout(time.sleep, 0.2, 0.01, 'test', outstanding) == (False, None)
+    assert len(outstanding) == 1
+    outstanding[0].join()
+
+
+def test_run_sequentially_stops_when_stop_event_is_set():
+    stop_event = threading.Event()
+    processed = []
+
+    def func(item):
+        processed.append(item[1])
+        if len(processed) == 2:
+            stop_event.set()
+
+    assert run_sequentially(func, iter(ITEMS), stop_event) == 2
+    assert processed == ['PR-1', 'PR-2']
+
+
+def test_run_in_pool_counts_failed_items():
+    func = Recorder(failing=('PR-1', 'PR-4'))
+    assert run_in_pool(func, ITEMS, workers=2) == 2
+    assert sorted(func.processed) == ['PR-1', 'PR-2', 'PR-3', 'PR-4', 'PR-5']
+
+
+def test_run_in_pool_takes_items_lazily():
+    in_flight = []
+    taken = [0]
+    lock = threading.Lock()
+
+    def items():
+        for item in ITEMS * 4:
+            with lock:
+                taken[0] += 1
+                in_flight.append(taken[0] - len(func.processed))
+            yield item
+
+    func = Recorder(delay=0.01)
+    assert run_in_pool(func, items(), workers=2) == 0
+    assert len(func.processed) == len(ITEMS) * 4
+    # items are taken from the iterable when slots are free, not all of them at once
+    assert max(in_flight) <= 2 * 2 + 1
+
+
+def test_run_in_pool_stops_when_stop_event_is_set():
+    stop_event = threading.Event()
+    processed = []
+
+    def func(item):
+        processed.append(item[1])
+        stop_event.set()
+
+    assert run_in_pool(func, ITEMS, workers=1, stop_event=stop_event) == 0
+    # items taken before the first one is finished are still processed
+    assert 1 <= len(processed) < len(ITEMS)
+
+
+def test_limiter_limits_concurrent_calls():
+    assert isinstance(limiter(0), NoLimit)
+    assert isinstance(limiter(None), NoLimit)
+
+    limit = limiter(2)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def func(item):
+        with limit:
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+    assert run_in_pool(func, range(10), workers=5) == 0
+    assert running[1] == 2
@@ -0,0 +1,75 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+
+from cloudblue_connector.core.connect_session import ConnectSession  # noqa: E402
+
+
+class Server(object):
+    """Local HTTP server which answers calls with listed statuses and records them"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def handle_call(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                server.calls.append((self.command, self.path, self.rfile.read(length)))
+                status = server.statuses.pop(0) if server.statuses else 200
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_GET = do_POST = handle_call
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def session():
+    return ConnectSession(retries=2, backoff=0, transition_retries=3, transition_backoff=0)
+
+
+@pytest.mark.parametrize('method, path, statuses, calls', [
+    # idempotent calls are repeated on server errors
+    ('get', '/usage/files', [502, 503, 200], 3),
+    ('get', '/usage/files', [502, 502, 502, 502], 3),
+    # other calls are not, they could be applied
+    ('post', '/requests/PR-1/approve/', [502, 200], 1),
+    # usage file transitions are repeated with their own number of retries
+    ('post', '/usage/files/UF-1/submit/', [502, 502, 502, 200], 4),
+    ('post', '/usage/files/UF-1/upload/', [502, 200], 1),
+    # throttled calls are rejected before processing, any call is repeated
+    ('post', '/requests/PR-1/approve/', [429, 200], 2),
+])
+def test_calls_are_repeated(session, method, path, statuses, calls):
+    server = Server(statuses)
+    try:
+        getattr(session, method)(server.url + path, data=b'{}')
+    finally:
+        server.close()
+    assert len(server.calls) == calls
+    assert all(body == b'{}' for _, _, body in server.calls)
@@ -0,0 +1,110 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+from cloudblue_connector.core.decorators import cached
+
+
+class Counter(object):
+
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, x, y=0):
+        with self.lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return x + y
+
+
+def test_results_are_cached_by_arguments():
+    func = Counter()
+    f = cached()(func)
+    assert f(1) == 1
+    assert f(1) == 1
+    assert f(1, y=2) == 3
+    assert f(1, 2) == 3
+    # positional and keyword arguments are different keys
+    assert func.calls == 3
+    assert f.cache.info().hits == 1
+
+    f.cache.invalidate(1)
+    assert f(1) == 1
+    assert func.calls == 4
+
+
+def test_least_recently_used_results_are_evicted():
+    func = Counter()
+    f = cached(maxsize=2)(func)
+    f(1)
+    f(2)
+    f(1)
+    f(3)
+    assert f.cache.info().size == 2
+    assert f.cache.info().evictions == 1
+    f(1)
+    assert func.calls == 3
+    f(2)
+    assert func.calls == 4
+
+
+def test_results_expire_after_ttl():
+    func = Counter()
+    f = cached(ttl=0.05)(func)
+    f(1)
+    f(1)
+    assert func.calls == 1
+    time.sleep(0.06)
+    f(1)
+    assert func.calls == 2
+
+
+def test_unhashable_arguments_are_not_cached():
+    f = cached()(lambda items: len(items))
+    assert f([1, 2]) == 2
+    assert f.cache.info().size == 0
+
+
+def test_errors_are_not_cached():
+    func = Counter(error=ValueError())
+    f = cached()(func)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            f(1)
+    assert func.calls == 2
+
+
+@pytest.mark.parametrize('error', [None, ValueError()])
+def test_concurrent_callers_share_single_flight(error):
+    func = Counter(delay=0.1, error=error)
+    f = cached(single_flight=True)(func)
+    results = []
+
+    def call():
+        try:
+            results.append(f(1))
+        except ValueError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert func.calls == 1
+    assert len(results) == 5
+    assert all(r == 1 for r in results) if error is None else all(r is error for r in results)
+    assert f.cache.info().shared == 4
@@ -0,0 +1,82 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('connect')
+
+from connect.config import Config  # noqa: E402
+from connect.models import ActivationTemplateResponse  # noqa: E402
+
+from cloudblue_connector.automation.fulfillment import FulfillmentAutomation  # noqa: E402
+
+PRODUCT_ID = 'PRD-000-000-001'
+
+
+def make_request(request_id, asset_id, migration=False):
+    return SimpleNamespace(
+        id=request_id,
+        status='pending',
+        asset=SimpleNamespace(id=asset_id, product=SimpleNamespace(id=PRODUCT_ID), marketplace=None),
+        needs_migration=lambda: migration,
+        get_conversation=lambda config: None,
+    )
+
+
+class Engine(FulfillmentAutomation):
+    """Engine with listed requests, backend and Connect transitions replaced by records"""
+
+    def __init__(self, requests, failing=(), workers=1):
+        config = Config(api_url='http://127.0.0.1/public/v1/', api_key='ApiKey SU-000:test', products=[PRODUCT_ID])
+        config.misc = {'fulfillment_workers': workers}
+        super(Engine, self).__init__(config)
+        self.requests = requests
+        self.failing = failing
+        self.backend_calls = []
+        self.approved = []
+
+    def list(self, filters=None):
+        return list(self.requests)
+
+    def test_marketplace_requests_filter(self, conf, request_id, marketplace):
+        return False
+
+    def process_fulfillment_request(self, request):
+        self.backend_calls.append(request.id)
+        if request.id in self.failing:
+            raise KeyError('params')
+        return ActivationTemplateResponse('TL-000-000-000'), {}
+
+    def approve(self, pk, data):
+        self.approved.append(pk)
+        return '{"id": "%s"}' % pk
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_requests_of_asset_are_skipped_after_failed_request(workers):
+    engine = Engine([make_request('PR-1', 'AS-1'), make_request('PR-2', 'AS-2'), make_request('PR-3', 'AS-1')],
+                    failing=('PR-1',), workers=workers)
+    engine.process()
+    assert sorted(engine.backend_calls) == ['PR-1', 'PR-2']
+    assert engine.approved == ['PR-2']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_requests_of_asset_are_skipped_after_skipped_request(workers):
+    engine = Engine([make_request('PR-1', 'AS-1', migration=True), make_request('PR-2', 'AS-1')], workers=workers)
+    engine.process()
+    assert engine.backend_calls == []
+    assert engine.approved == []
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_requests_of_asset_are_processed_in_order(workers):
+    engine = Engine([make_request('PR-1', 'AS-1'), make_request('PR-2', 'AS-1')], workers=workers)
+    engine.process()
+    assert engine.backend_calls == ['PR-1', 'PR-2']
+    assert engine.approved == ['PR-1', 'PR-2']
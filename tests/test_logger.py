@@ -0,0 +1,101 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+
+import pytest
+
+from cloudblue_connector.core.logger import (
+    PasswordFilter, config_context, context_data, context_log, use_context_config)
+
+
+def make_config(product):
+    from connect.config import Config
+
+    return Config(api_url='http://127.0.0.1/public/v1/', api_key='ApiKey SU-000:test', products=[product])
+
+
+class Engine(object):
+
+    def __init__(self, config):
+        self.config = config
+
+    @context_log
+    def dispatch(self, request):
+        from connect.config import Config
+
+        return context_data.request_id, Config.get_instance()
+
+
+def test_config_instance_is_config_of_engine_in_thread():
+    pytest.importorskip('connect')
+    from connect.config import Config
+
+    first_config = make_config('PRD-000')
+    fulfillment_config = make_config('PRD-001')
+    usage_config = make_config('PRD-002')
+    Config._instance = first_config
+    use_context_config()
+    use_context_config()
+
+    request = type('Request', (), {'id': 'PR-1'})
+    assert Engine(usage_config).dispatch(request) == ('PR-1', usage_config)
+    with config_context(fulfillment_config):
+        assert Config.get_instance() is fulfillment_config
+        assert Engine(usage_config).dispatch(request)[1] is usage_config
+        assert Config.get_instance() is fulfillment_config
+
+        found = []
+        thread = threading.Thread(target=lambda: found.append(Config.get_instance()))
+        thread.start()
+        thread.join()
+        # context of thread is not shared
+        assert found[0] is first_config
+    assert Config.get_instance() is first_config
+
+
+@pytest.fixture
+def password_filter():
+    is_enabled, max_payload_size = PasswordFilter.is_enabled, PasswordFilter.max_payload_size
+    PasswordFilter.is_enabled = True
+    yield PasswordFilter()
+    PasswordFilter.is_enabled, PasswordFilter.max_payload_size = is_enabled, max_payload_size
+
+
+def make_record(msg, *args):
+    return logging.LogRecord('test', logging.DEBUG, __file__, 1, msg, args or None, None)
+
+
+PAYLOAD = json.dumps([{'id': 'PR-1', 'asset': {'params': [
+    {'id': 'password', 'type': 'password', 'value': 's3cret'},
+    {'id': 'login', 'type': 'text', 'value': 'admin'},
+]}}])
+
+
+def test_passwords_are_hidden_in_api_payload(password_filter):
+    record = make_record('Function `ApiClient.get` return: (%s, 200)', repr(PAYLOAD))
+    assert password_filter.filter(record)
+    message = record.getMessage()
+    assert 's3cret' not in message
+    assert '***hidden***' in message
+    assert 'admin' in message
+
+
+def test_records_without_passwords_are_not_changed(password_filter):
+    record = make_record('Function `ApiClient.get` return: (%s, 200)', repr(PAYLOAD.replace('"password"', '"pwd"')))
+    assert password_filter.filter(record)
+    assert record.args is not None
+    assert 's3cret' in record.getMessage()
+
+
+def test_large_payload_with_passwords_is_hidden(password_filter):
+    PasswordFilter.max_payload_size = 100
+    record = make_record('Function `ApiClient.get` return: (%s, 200)', repr(PAYLOAD))
+    assert password_filter.filter(record)
+    assert 's3cret' not in record.getMessage()
+    assert record.getMessage().startswith('***hidden*** payload of')
@@ -0,0 +1,74 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+from cloudblue_connector.core.rate_limit import AdaptiveRateLimiter, backoff_delay, retry_after
+
+
+def elapsed(func, *args):
+    started = time.monotonic()
+    func(*args)
+    return time.monotonic() - started
+
+
+def acquire_many(limiter, count):
+    for _ in range(count):
+        limiter.acquire()
+
+
+def test_calls_are_not_limited_without_max_rate():
+    limiter = AdaptiveRateLimiter()
+    assert elapsed(acquire_many, limiter, 1000) < 0.5
+    limiter.on_throttle()
+    limiter.on_success()
+    assert limiter.rate is None
+
+
+def test_calls_are_limited_by_rate():
+    limiter = AdaptiveRateLimiter(max_rate=50, burst=1)
+    # the first call takes the burst token, the next ones wait 1/50 second each
+    assert elapsed(acquire_many, limiter, 6) >= 0.09
+
+
+def test_rate_is_decreased_on_throttle_and_increased_on_success():
+    limiter = AdaptiveRateLimiter(max_rate=10, min_rate=2, increase=1)
+    limiter.on_throttle()
+    assert limiter.rate == 5
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 2
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == 10
+
+
+def test_calls_wait_for_retry_after():
+    limiter = AdaptiveRateLimiter()
+    limiter.on_throttle(0.1)
+    assert elapsed(limiter.acquire) >= 0.09
+    assert elapsed(limiter.acquire) < 0.05
+
+
+def response_with(value):
+    return SimpleNamespace(headers={'Retry-After': value} if value is not None else {})
+
+
+def test_retry_after_is_parsed_from_seconds_and_date():
+    assert retry_after(response_with(None)) is None
+    assert retry_after(response_with('2.5')) == 2.5
+    assert retry_after(response_with('-1')) == 0
+    assert retry_after(response_with('soon')) is None
+    at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry_after(response_with(at)) <= 30
+
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 0.5, 4) <= min(4, 0.5 * 2 ** attempt)
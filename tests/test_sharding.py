@@ -0,0 +1,96 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from cloudblue_connector.core.sharding import LeaseShard, StaticShard, create_shard, shard_of
+
+ASSETS = ['AS-{:04d}'.format(i) for i in range(100)]
+
+
+def test_shard_of_is_stable():
+    # crc32 is the same on all nodes and Python versions, unlike hash()
+    assert [shard_of(asset, 3) for asset in ASSETS[:8]] == [2, 1, 1, 0, 1, 1, 1, 0]
+
+
+def test_static_shards_partition_assets():
+    shards = [StaticShard(index, 3) for index in range(3)]
+    for asset in ASSETS:
+        assert sum(shard.owns(asset) for shard in shards) == 1
+    assert all(any(shard.owns(asset) for asset in ASSETS) for shard in shards)
+    with pytest.raises(ValueError):
+        StaticShard(3, 3)
+
+
+def test_create_shard_from_options(tmp_path):
+    assert create_shard({}) is None
+    assert isinstance(create_shard({'shard_count': 2, 'shard_index': 1}), StaticShard)
+    assert isinstance(create_shard({'shard_store': str(tmp_path / 'shards.sqlite3')}), LeaseShard)
+
+
+def make_nodes(store, heartbeat_ttl=300):
+    nodes = [LeaseShard(store, 'node-a', heartbeat_ttl), LeaseShard(store, 'node-b', heartbeat_ttl)]
+    for node in nodes:
+        node.refresh()
+    # the first node takes partition with both nodes registered
+    nodes[0].refresh()
+    return nodes
+
+
+def test_live_nodes_partition_assets(tmp_path):
+    a, b = make_nodes(str(tmp_path / 'state' / 'shards.sqlite3'))
+    assert (a.index, a.count) == (0, 2)
+    assert (b.index, b.count) == (1, 2)
+    for asset in ASSETS:
+        assert a.owns(asset) != b.owns(asset)
+
+
+def test_assets_of_stopped_node_are_taken_by_live_nodes(tmp_path):
+    a, b = make_nodes(str(tmp_path / 'shards.sqlite3'), heartbeat_ttl=0.2)
+    time.sleep(0.3)
+    a.refresh()
+    assert (a.index, a.count) == (0, 1)
+    assert all(a.owns(asset) for asset in ASSETS)
+
+
+def test_report_is_claimed_by_one_node(tmp_path):
+    store = str(tmp_path / 'shards.sqlite3')
+    # Asset of node-b when both nodes are live
+    asset = next(asset for asset in ASSETS if shard_of(asset, 2) == 1)
+    report_name = asset + '_2023-01-10_10h'
+
+    a = LeaseShard(store, 'node-a')
+    a.refresh()
+    assert a.claim(asset, report_name)
+    # the same report is claimed again by its node, e.g. by the next window of the run
+    assert a.claim(asset, report_name)
+
+    # node which owns the Asset after it joined does not create the report claimed by another node
+    b = LeaseShard(store, 'node-b')
+    b.refresh()
+    assert b.owns(asset)
+    assert not b.claim(asset, report_name)
+
+    a.release(report_name)
+    assert b.claim(asset, report_name)
+
+
+def test_claims_which_are_not_confirmed_expire(tmp_path):
+    store = str(tmp_path / 'shards.sqlite3')
+    a = LeaseShard(store, 'node-a', heartbeat_ttl=0.2)
+    a.refresh()
+    assert a.claim('AS-0001', 'AS-0001_2023-01-10_10h')
+    assert a.claim('AS-0001', 'AS-0001_2023-01-10_11h')
+    a.confirm('AS-0001_2023-01-10_11h')
+    time.sleep(0.3)
+
+    # claims of failed node-a: confirmed one is kept, the other is expired and can be claimed again
+    b = LeaseShard(store, 'node-b', heartbeat_ttl=0.2)
+    b.refresh()
+    assert b.claim('AS-0001', 'AS-0001_2023-01-10_10h')
+    assert not b.claim('AS-0001', 'AS-0001_2023-01-10_11h')
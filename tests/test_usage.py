@@ -0,0 +1,104 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('connect')
+
+from connect.config import Config  # noqa: E402
+
+from cloudblue_connector.automation.usage import UsageAutomation  # noqa: E402
+
+CURRENT_DATE = datetime(2023, 1, 10, 12, 30)
+
+
+def make_engine(**misc):
+    config = Config(api_url='http://127.0.0.1/public/v1/', api_key='ApiKey SU-000:test', products=['PRD-1'])
+    config.misc = misc
+    engine = UsageAutomation(config)
+    engine.listed = []
+    engine.usage_files.list = lambda filters=None: engine.listed.append(str(filters)) or []
+    return engine
+
+
+def test_usage_reports_are_prefetched_after_min_lookups(tmp_path):
+    engine = make_engine(usage_state_db=str(tmp_path / 'usage_state.sqlite3'), usage_prefetch_min_lookups=2)
+    for asset_id in ('AS-1', 'AS-2'):
+        assert engine.get_last_usage_report(asset_id, CURRENT_DATE) is None
+    assert len(engine.listed) == 2
+    assert all(asset_id in filters for asset_id, filters in zip(('AS-1', 'AS-2'), engine.listed))
+
+    for asset_id in ('AS-3', 'AS-4'):
+        assert engine.get_last_usage_report(asset_id, CURRENT_DATE) is None
+    # one page of usage files of the month is listed for the rest of Assets
+    assert len(engine.listed) == 3
+    assert 'AS-3' not in engine.listed[2]
+
+    engine.reset_usage_reports()
+    engine.get_last_usage_report('AS-1', CURRENT_DATE)
+    assert len(engine.listed) == 4
+    assert 'AS-1' in engine.listed[3]
+
+
+def test_usage_reports_are_prefetched_at_first_lookup_without_local_state():
+    engine = make_engine(usage_state_db='')
+    for asset_id in ('AS-1', 'AS-2'):
+        assert engine.get_last_usage_report(asset_id, CURRENT_DATE) is None
+    assert len(engine.listed) == 1
+    assert 'AS-1' not in engine.listed[0]
+
+
+def test_usage_is_reported_without_local_state_which_cannot_be_opened(tmp_path):
+    # state directory cannot be created under a file
+    (tmp_path / 'file').write_text('')
+    engine = make_engine(usage_state_db=str(tmp_path / 'file' / 'usage_state.sqlite3'))
+    assert engine.usage_state is None
+    assert not engine.is_usage_reported('AS-1', CURRENT_DATE)
+
+
+class CatchUpEngine(UsageAutomation):
+    """Engine with the last accepted report and Connect calls replaced by records"""
+
+    def __init__(self, config, last_report):
+        super(CatchUpEngine, self).__init__(config)
+        self.last_report = last_report
+        self.submitted = []
+
+    def is_resource_exist(self, subscription_id):
+        return True
+
+    def get_last_usage_report(self, subscription_id, current_date):
+        return self.last_report
+
+    def collect_usage_records(self, items, subscription_id, start_time, end_time):
+        return [self.create_record(subscription_id, start_time, end_time, 'CPU_consumption', 1)]
+
+    def submit_usage(self, usage_file, usage_records):
+        self.submitted.append(usage_file.name)
+
+
+def make_asset(asset_id):
+    return SimpleNamespace(id=asset_id, marketplace=None, params=[], product=SimpleNamespace(id='PRD-1'),
+                           contract=SimpleNamespace(id='CRD-1'), items=[SimpleNamespace(mpn='CPU_consumption')])
+
+
+@pytest.mark.parametrize('max_reports, expected', [(None, 3), (2, 2), (1, 1)])
+def test_missed_hours_are_caught_up(max_reports, expected):
+    last_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=4)
+    last_report = SimpleNamespace(name='AS-1_{}'.format(last_hour.strftime('%Y-%m-%d_%Hh')), status='accepted',
+                                  description='Report for AS-1 {}'.format(last_hour.strftime('%Y-%m-%d %H:%M:%S')))
+    config = Config(api_url='http://127.0.0.1/public/v1/', api_key='ApiKey SU-000:test', products=['PRD-1'])
+    config.misc = {'usage_state_db': ''}
+    if max_reports:
+        config.misc['usage_catchup_max_reports'] = max_reports
+    engine = CatchUpEngine(config, last_report)
+
+    engine.process_request(make_asset('AS-1'))
+    assert engine.submitted == ['AS-1_{}'.format((last_hour + timedelta(hours=i)).strftime('%Y-%m-%d_%Hh'))
+                                for i in range(1, expected + 1)]
@@ -0,0 +1,26 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import pytest
+
+pytest.importorskip('connect')
+
+from connect.config import Config  # noqa: E402
+
+from cloudblue_connector.automation.usage import UsageAutomation  # noqa: E402
+from cloudblue_connector.core.sharding import LeaseShard  # noqa: E402
+
+
+def test_shard_is_created_at_first_use(tmp_path):
+    config = Config(api_url='http://127.0.0.1/public/v1/', api_key='ApiKey SU-000:test', products=['PRD-1'])
+    config.misc = {'usage_state_db': '', 'shard_store': str(tmp_path / 'shards.sqlite3')}
+    engine = UsageAutomation(config)
+    assert isinstance(engine.shard, LeaseShard)
+
+    # engine listing usage files for usage service does not create its own shard
+    assert not engine.usage_files._shard_created
+    assert engine.usage_files.shard is engine.usage_files.shard
+    assert isinstance(engine.usage_files.shard, LeaseShard)
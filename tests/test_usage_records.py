@@ -0,0 +1,52 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+import email.parser
+import io
+from datetime import datetime
+
+import pytest
+
+from cloudblue_connector.automation.usage_records import USAGE_COLUMNS, MultipartFile, UsageRecord, UsageWindow
+
+
+def test_compact_record_row_has_columns_of_sdk_records():
+    window = UsageWindow('AS-1', datetime(2023, 1, 1, 11), datetime(2023, 1, 1, 12), 'id', 'AS-1-2023-01-01T12:00:00-')
+    record = UsageRecord(window, 'CPU_consumption', 1.5)
+    row = record.row()
+    assert len(row) == len(USAGE_COLUMNS)
+    assert row == tuple(getattr(record, attribute) for _, attribute in USAGE_COLUMNS)
+    assert row[:10] == ('AS-1-2023-01-01T12:00:00-CPU_consumption', None, 'item.mpn', 'CPU_consumption', 1.5, 1.5,
+                        '2023-01-01 11:00:00', '2023-01-01 12:00:00', 'id', 'AS-1')
+
+
+def read_in_chunks(body, size):
+    chunks = []
+    while True:
+        chunk = body.read(size)
+        if not chunk:
+            return b''.join(chunks)
+        assert len(chunk) <= size
+        chunks.append(chunk)
+
+
+def test_multipart_body_is_read_in_chunks_and_rewound():
+    content = bytes(range(256)) * 100
+    body = MultipartFile('usage_file', 'usage_file.xlsx', io.BytesIO(content))
+    data = read_in_chunks(body, 1000)
+    assert len(data) == len(body)
+
+    message = email.parser.BytesParser().parsebytes(
+        'Content-Type: {}\r\n\r\n'.format(body.content_type).encode('utf-8') + data)
+    part, = message.get_payload()
+    assert part.get_param('name', header='content-disposition') == 'usage_file'
+    assert part.get_filename() == 'usage_file.xlsx'
+    assert part.get_payload(decode=True) == content
+
+    body.seek(0)
+    assert body.read() == data
+    with pytest.raises(io.UnsupportedOperation):
+        body.seek(10)
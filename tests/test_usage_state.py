@@ -0,0 +1,26 @@
+# ******************************************************************************
+# Copyright (c) 2020-2023, Virtuozzo International GmbH.
+# This source code is distributed under MIT software license.
+# ******************************************************************************
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from cloudblue_connector.core.usage_state import UsageReportState
+
+
+def test_last_report_is_stored_per_subscription(tmp_path):
+    state_db = str(tmp_path / 'state' / 'usage_state.sqlite3')
+    state = UsageReportState(state_db)
+    assert state.get_last_report('AS-1') is None
+
+    state.set_last_report('AS-1', 'AS-1_2023-01-10_10h', datetime(2023, 1, 10, 11), 'submitted')
+    state.set_last_report('AS-1', 'AS-1_2023-01-10_11h', datetime(2023, 1, 10, 12, 0, 0, 123), 'submitted')
+    state.set_last_report('AS-2', 'AS-2_2023-01-10_10h', datetime(2023, 1, 10, 11), 'accepted')
+    state.close()
+
+    # state is kept in database between runs, period end is stored with second precision
+    state = UsageReportState(state_db)
+    assert state.get_last_report('AS-1') == ('AS-1_2023-01-10_11h', datetime(2023, 1, 10, 12), 'submitted')
+    assert state.get_last_report('AS-2') == ('AS-2_2023-01-10_10h', datetime(2023, 1, 10, 11), 'accepted')
+    state.close()